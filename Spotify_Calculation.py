@@ -1,31 +1,25 @@
-import sqlite3
+import schema
+from report_engine import ReportEngine
 
-# Connect to your existing database
-conn = sqlite3.connect("music_data.db")
-cur = conn.cursor()
+DB_NAME = "music_data.db"
 
-# JOIN Songs and Genres, count songs per genre
-cur.execute("""
-    SELECT g.genre_name, COUNT(*) as genre_count
-    FROM Songs s
-    JOIN Genres g ON s.genre_id = g.genre_id
-    GROUP BY g.genre_name
-""")
 
-results = cur.fetchall()
+def write_genre_percentages(cur, filename="Spotify_Calculations.txt", engine=None):
+    # Genre counts and percentages, formatted by the report engine
+    if engine is None:
+        engine = ReportEngine(cur.connection)
+    engine.render("genres", {"txt": filename})
 
-# Total number of songs
-cur.execute("SELECT COUNT(*) FROM Songs")
-total_songs = cur.fetchone()[0]
+    print(f"Genre percentages written to {filename}")
 
-# Write to TXT file
-with open("Spotify_Calculations.txt", "w") as f:
-    f.write("Genre Percentages:\n")
-    f.write("=================\n")
-    for genre_name, count in results:
-        percentage = round((count / total_songs) * 100, 2)
-        f.write(f"Genre: {genre_name}, Count: {count}, Percentage: {percentage}%\n")
 
-print("Genre percentages written to Spotify_Calculations.txt")
+def main():
+    # Connect to your existing database
+    conn = schema.connect(DB_NAME)
+    cur = conn.cursor()
+    write_genre_percentages(cur)
+    conn.close()
 
-conn.close()
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
@@ -4,40 +4,75 @@
 
 from dotenv import load_dotenv
 import os
-import base64
-from requests import post, get
+from http_client import get
 import json
-import sqlite3
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from spotify_token import TokenProvider
+from store_spotify import (load_id_maps, store_songs, get_ingest_state, save_ingest_state,
+                           load_playlist_track_ids, remove_playlist_tracks,
+                           load_playlist_artists, fill_playlist_artist_ids)
+from response_cache import ResponseCache
+from name_cache import NameCache
+import schema
+from chart_history import record_spotify_snapshot
 
 load_dotenv()
 
 client_id = os.getenv("CLIENT_ID")
 client_secret = os.getenv("CLIENT_SECRET")
 
+# Spotify's /v1/artists endpoint accepts at most 50 IDs per request
+ARTIST_BATCH_SIZE = 50
+ARTIST_WORKERS = 4
+
+# Largest page /playlists/{id}/tracks will return
+PLAYLIST_PAGE_SIZE = 100
+
+# Only the parts of each playlist item that the ingest loop reads
+PLAYLIST_TRACK_FIELDS = "next,items(track(id,name,artists(id,name)))"
+
+# Number of new songs stored per run
+BATCH_SIZE = 25
+
+# Artist details change slowly, so they are kept locally
+response_cache = ResponseCache()
+
+# Names we have searched for before, mapped to their Spotify IDs
+name_cache = NameCache()
+
 def get_token():
-    # Function to get Spotify API token using client_id and client_secret
-    
-    auth_string = client_id + ":" + client_secret
-    auth_bytes = auth_string.encode("utf-8")
-    auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
-    
-    url = 'https://accounts.spotify.com/api/token'
-    
-    headers = {
-        "Authorization": "Basic " + auth_base64,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    
-    data = {"grant_type": "client_credentials"}
-    result = post(url, headers=headers, data=data)
-    json_result = json.loads(result.content)
-    token = json_result["access_token"]
-    return token
+    # Function to get a Spotify API token provider. The token itself is
+    # cached on disk and only requested again shortly before it expires.
+
+    return TokenProvider(client_id, client_secret)
 
 def get_auth_header(token):
     # Function to create authorization header for Spotify API requests
     
-    return {"Authorization": "Bearer " + token}
+    return {"Authorization": "Bearer " + token.get()}
+
+def spotify_get(token, url, extra_headers=None):
+    # Function to send a GET request to the Spotify API. If the token is
+    # rejected, it is refreshed once and the request is retried.
+
+    access_token = token.get()
+    headers = {"Authorization": "Bearer " + access_token}
+    if extra_headers:
+        headers.update(extra_headers)
+
+    result = get(url, headers=headers)
+    if result.status_code == 401:
+        token.refresh(access_token)
+        headers.update(get_auth_header(token))
+        result = get(url, headers=headers)
+    return result
+
+def spotify_get_cached(token, url):
+    # Function to GET from the Spotify API through the local response cache.
+    # Returns the response body; only cacheable endpoints are stored.
+
+    return response_cache.get(url, lambda extra_headers: spotify_get(token, url, extra_headers))
 
 #--------------------------------------------------------------------------------------------
 # Artist functions
@@ -46,14 +81,13 @@ def search_for_artist(token, artist_name):
     # Function to search for an artist by name
     
     url = "https://api.spotify.com/v1/search"
-    headers = get_auth_header(token)
     
     #could be type=artist, album, track, playlist, etc.
-    query = f"?q={artist_name}&type=artist&limit=1"
-    query_url = url + query
+    query = urlencode({"q": artist_name, "type": "artist", "limit": 1})
+    query_url = url + "?" + query
     
-    result = get(query_url, headers=headers)
-    json_result = json.loads(result.content)["artists"]["items"]
+    content = spotify_get_cached(token, query_url)
+    json_result = json.loads(content)["artists"]["items"]
     
     if len(json_result) == 0:
         print("No artist found with that name...")
@@ -65,9 +99,8 @@ def get_songs_by_artist(token, aritst_id):
     # Function to get songs by artist ID
     
     url = f"https://api.spotify.com/v1/artists/{aritst_id}/top-tracks?country=US"
-    headers = get_auth_header(token)
     
-    result = get(url, headers=headers)
+    result = spotify_get(token, url)
     json_result = json.loads(result.content)["tracks"]
     
     return json_result
@@ -75,9 +108,72 @@ def get_songs_by_artist(token, aritst_id):
 def get_artist_info(token, artist_id):
     # Function to get artist details (including genres)
     url = f"https://api.spotify.com/v1/artists/{artist_id}"
-    headers = get_auth_header(token)
-    result = get(url, headers=headers)
-    return json.loads(result.content)
+    content = spotify_get_cached(token, url)
+    return json.loads(content)
+
+def get_several_artists(token, artist_ids):
+    # Function to get details for up to 50 artists in one request.
+    # Artists already in the response cache are not requested again, and
+    # each fetched artist is cached on its own for later runs.
+
+    artists = {}
+    missing = []
+    for artist_id in artist_ids:
+        content = response_cache.peek(f"https://api.spotify.com/v1/artists/{artist_id}")
+        if content is None:
+            missing.append(artist_id)
+        else:
+            artists[artist_id] = json.loads(content)
+
+    if missing:
+        url = "https://api.spotify.com/v1/artists?ids=" + ",".join(missing)
+        result = spotify_get(token, url)
+        for info in json.loads(result.content)["artists"]:
+            # Unknown IDs come back as null
+            if info is None:
+                continue
+            artists[info["id"]] = info
+            response_cache.put(f"https://api.spotify.com/v1/artists/{info['id']}",
+                               json.dumps(info).encode("utf-8"))
+
+    return [artists.get(artist_id) for artist_id in artist_ids]
+
+def resolve_artists(token, songs, max_workers=ARTIST_WORKERS):
+    # Function to look up the first artist of every song in a batch.
+    # Each artist ID is fetched once. Returns {artist_id: artist_info}.
+
+    artist_ids = []
+    seen = set()
+    for song in songs:
+        artist_id = song["artists"][0]["id"]
+        # Local files have no Spotify artist ID
+        if artist_id is None or artist_id in seen:
+            continue
+        seen.add(artist_id)
+        artist_ids.append(artist_id)
+
+    return get_artists(token, artist_ids, max_workers)
+
+def get_artists(token, artist_ids, max_workers=ARTIST_WORKERS):
+    # Function to look up a list of distinct artist IDs, 50 per request,
+    # spread over a small thread pool. Returns {artist_id: artist_info}.
+
+    chunks = []
+    for start in range(0, len(artist_ids), ARTIST_BATCH_SIZE):
+        chunks.append(artist_ids[start:start + ARTIST_BATCH_SIZE])
+
+    artists = {}
+    if not chunks:
+        return artists
+
+    workers = min(max_workers, len(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in pool.map(lambda ids: get_several_artists(token, ids), chunks):
+            for info in batch:
+                if info is not None:
+                    artists[info["id"]] = info
+
+    return artists
 
 #--------------------------------------------------------------------------------------------
 # Playlist functions
@@ -86,13 +182,12 @@ def search_for_playlist(token, playlist_name):
     # Function to search for a playlist by name
     
     url = "https://api.spotify.com/v1/search"
-    headers = get_auth_header(token)
     
-    query = f"?q={playlist_name}&type=playlist&limit=1"
-    query_url = url + query
+    query = urlencode({"q": playlist_name, "type": "playlist", "limit": 1})
+    query_url = url + "?" + query
     
-    result = get(query_url, headers=headers)
-    json_result = json.loads(result.content)["playlists"]["items"]
+    content = spotify_get_cached(token, query_url)
+    json_result = json.loads(content)["playlists"]["items"]
     
     if len(json_result) == 0:
         print("No playlist found with that name...")
@@ -100,91 +195,249 @@ def search_for_playlist(token, playlist_name):
         
     return json_result[0]
 
+def resolve_names(token, kind, names, max_workers=ARTIST_WORKERS, call=None):
+    # Function to turn artist or playlist names into Spotify IDs. Names
+    # resolved before come from the name cache; the rest are searched for
+    # concurrently. Returns {name: ID, or None if nothing was found}.
+    # call(search, token, name), if given, runs each search, e.g. under a
+    # caller's rate limiter.
+
+    searches = {"artist": search_for_artist, "playlist": search_for_playlist}
+    search = searches[kind]
+    if call is None:
+        return name_cache.resolve(kind, names, lambda name: search(token, name), max_workers)
+    return name_cache.resolve(kind, names, lambda name: call(search, token, name), max_workers)
+
+def resolve_artist_id(token, artist_name):
+    # Function to get one artist's ID by name, through the name cache
+
+    return resolve_names(token, "artist", [artist_name])[artist_name]
+
+def resolve_playlist_id(token, playlist_name):
+    # Function to get one playlist's ID by name, through the name cache
+
+    return resolve_names(token, "playlist", [playlist_name])[playlist_name]
+
+def get_playlist_snapshot(token, playlist_id):
+    # Function to get a playlist's snapshot_id (which changes whenever the
+    # playlist is edited) and its number of tracks
+
+    url = f"https://api.spotify.com/v1/playlists/{playlist_id}?fields=snapshot_id,tracks.total"
+    result = spotify_get(token, url)
+    json_result = json.loads(result.content)
+    return json_result["snapshot_id"], json_result["tracks"]["total"]
+
+def iter_playlist_pages(token, playlist_id, fields=None, offset=0, limit=PLAYLIST_PAGE_SIZE,
+                        skip_missing=True):
+    # Generator that yields the tracks of a playlist one page at a time.
+    # The next page is only requested when the caller asks for it, so a
+    # caller that stops early never downloads the rest of the playlist.
+    # fields is a Spotify field filter, e.g. PLAYLIST_TRACK_FIELDS.
+    # With skip_missing=False, unavailable tracks are yielded as None so
+    # list positions match playlist positions.
+
+    params = {"offset": offset, "limit": limit}
+    if fields is not None:
+        # Paging needs the next link, so always keep it in the projection
+        if "next" not in fields.split(","):
+            fields = "next," + fields
+        params["fields"] = fields
+
+    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?" + urlencode(params)
+
+    while url is not None:
+        result = spotify_get(token, url)
+        page = json.loads(result.content)
+
+        tracks = []
+        for item in page["items"]:
+            # Tracks removed from Spotify come back as null
+            if item.get("track") is not None:
+                tracks.append(item["track"])
+            elif not skip_missing:
+                tracks.append(None)
+
+        yield tracks
+        url = page.get("next")
+
 def get_songs_by_playlist(token, playlist_id):
-    # Function to get songs by playlist ID
-    
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    headers = get_auth_header(token)
-    
-    result = get(url, headers=headers)
-    json_result = json.loads(result.content)["items"]
+    # Function to get all songs by playlist ID
     
     songs = []
-    for item in json_result:
-        songs.append(item["track"])
+    for page in iter_playlist_pages(token, playlist_id):
+        songs.extend(page)
         
     return songs
 
 #--------------------------------------------------------------------------------------------
-# Main code to test the functions
-    
-token = get_token()
-result = search_for_playlist(token, "old songs(2000-2017)")
-playlist_id = result["id"]
-playlist_name = result["name"]
-print(f"Playlist: {playlist_name}\n")
-songs = get_songs_by_playlist(token, playlist_id)
-
-
-# ------------------ DATABASE SETUP -------------------------------------------------------------
-conn = sqlite3.connect("music_data.db")
-cur = conn.cursor()
-
-cur.execute("""CREATE TABLE IF NOT EXISTS Artists (
-    artist_id INTEGER PRIMARY KEY,
-    artist_name TEXT UNIQUE NOT NULL
-)""")
-
-cur.execute("""CREATE TABLE IF NOT EXISTS Genres (
-    genre_id INTEGER PRIMARY KEY,
-    genre_name TEXT UNIQUE NOT NULL
-)""")
-
-cur.execute("""CREATE TABLE IF NOT EXISTS Songs (
-    song_name TEXT NOT NULL,
-    artist_id INTEGER,
-    popularity INTEGER,
-    genre_id INTEGER,
-    UNIQUE(song_name, artist_id),
-    FOREIGN KEY (artist_id) REFERENCES Artists(artist_id),
-    FOREIGN KEY (genre_id) REFERENCES Genres(genre_id)
-)""")
-
-artist_map = {}
-genre_map = {}
-artist_counter = 0
-genre_counter = 0
-
-# Determine offset based on how many songs already stored
-cur.execute("SELECT COUNT(*) FROM Songs")
-offset = cur.fetchone()[0]
-batch = songs[offset:offset+25]
-
-for idx, song in enumerate(batch, start=offset+1):
-    artist_name = song["artists"][0]["name"]
+# Ingest functions
+
+def build_song_row(song, artists):
+    # Function to turn a track and its resolved artists (from
+    # resolve_artists) into the row dict store_songs() expects.
+    # genre_name is the first genre (kept on Songs); genres has all of them.
 
-    # Insert artist and get ID
-    cur.execute("INSERT OR IGNORE INTO Artists (artist_name) VALUES (?)", (artist_name,))
-    cur.execute("SELECT artist_id FROM Artists WHERE artist_name = ?", (artist_name,))
-    artist_id = cur.fetchone()[0]
+    artist_name = song["artists"][0]["name"]
 
     # Get genre info
     first_artist_id = song["artists"][0]["id"]
-    artist_info = get_artist_info(token, first_artist_id)
-    popularity = artist_info["popularity"]
-    genres = artist_info.get("genres", [])
+    artist_info = artists.get(first_artist_id, {})
+    popularity = artist_info.get("popularity")
+    # None (rather than []) when the artist could not be looked up, so
+    # the genres already stored for it are left alone
+    genres = artist_info.get("genres")
     genre_name = genres[0] if genres else "Unknown"
 
-    # Insert genre and get ID
-    cur.execute("INSERT OR IGNORE INTO Genres (genre_name) VALUES (?)", (genre_name,))
-    cur.execute("SELECT genre_id FROM Genres WHERE genre_name = ?", (genre_name,))
-    genre_id = cur.fetchone()[0]
+    return {
+        "track_id": song["id"],
+        "song_name": song["name"],
+        "artist_name": artist_name,
+        "spotify_artist_id": first_artist_id,
+        "popularity": popularity,
+        "genre_name": genre_name,
+        "genres": genres
+    }
 
-    # Insert song record
-    cur.execute("INSERT OR IGNORE INTO Songs (song_name, artist_id, popularity, genre_id) VALUES (?, ?, ?, ?)",
-                (song["name"], artist_id, popularity, genre_id))
+def record_playlist_popularity(token, conn, cur, playlist_id):
+    # Function to record the popularity of every artist on a stored
+    # playlist as one snapshot, so artists are sampled on every run and not
+    # only when one of their songs is new. Artist details come through the
+    # response cache, so this is usually only a few requests. Returns the
+    # snapshot_id, or None if there was nothing to record.
 
-    print(f"{idx}. {artist_name} | {song['name']} | Popularity: {popularity} | Genre: {genre_name}")
-    
-conn.commit()
-conn.close()
+    artist_ids = load_playlist_artists(cur, playlist_id)
+    artists = get_artists(token, list(artist_ids))
+
+    popularity = {}
+    for spotify_id, artist_id in artist_ids.items():
+        info = artists.get(spotify_id)
+        if info is not None:
+            popularity[artist_id] = info.get("popularity")
+    return record_spotify_snapshot(conn, cur, popularity)
+
+def ingest_playlist(token, conn, cur, playlist_id, artist_map, genre_map, batch_size=BATCH_SIZE):
+    # Function to bring the stored copy of a playlist up to date, storing at
+    # most batch_size new songs (None for no limit). Returns the number of
+    # new songs stored.
+    #
+    # If the playlist's snapshot_id is the one we finished last time, nothing
+    # is downloaded. If it is the same snapshot but we stopped part way, we
+    # resume from the saved cursor. If the snapshot changed, the playlist is
+    # listed once (IDs and names only) and diffed against PlaylistTracks:
+    # removed tracks are deleted and only added tracks are looked up.
+
+    snapshot_id, total = get_playlist_snapshot(token, playlist_id)
+    state = get_ingest_state(cur, playlist_id)
+
+    if state is not None and state[0] == snapshot_id and state[1] >= total:
+        print(f"Playlist unchanged since last run (snapshot {snapshot_id}).")
+        record_playlist_popularity(token, conn, cur, playlist_id)
+        return 0
+
+    # A new snapshot can reorder, add or remove anywhere, so it is read in
+    # full; the same snapshot only needs the part after the cursor
+    full_scan = state is None or state[0] != snapshot_id
+    start = 0 if full_scan else state[1]
+
+    known = load_playlist_track_ids(cur, playlist_id)
+    current = set()
+    # First artist of every stored track seen, for tracks stored before
+    # PlaylistTracks kept Spotify artist IDs
+    known_artists = {}
+    pending = []
+    pending_ids = set()
+    cursor = None
+    position = start
+
+    pages = iter_playlist_pages(token, playlist_id, fields=PLAYLIST_TRACK_FIELDS,
+                                offset=start, skip_missing=False)
+    for page in pages:
+        for track in page:
+            track_id = None
+            if track is not None:
+                track_id = track.get("id")
+
+            # Local files and unavailable tracks have no ID and are skipped
+            if track_id is not None:
+                current.add(track_id)
+                if track_id in known and track.get("artists"):
+                    known_artists[track_id] = track["artists"][0]["id"]
+                if track_id not in known and track_id not in pending_ids:
+                    if batch_size is None or len(pending) < batch_size:
+                        pending.append((position, track))
+                        pending_ids.add(track_id)
+                    elif cursor is None:
+                        # First new track that has to wait for the next run
+                        cursor = position
+
+            position += 1
+
+        # Without removals to find, there is no need to read further
+        if not full_scan and cursor is not None:
+            break
+
+    if cursor is None:
+        cursor = position
+
+    if full_scan:
+        removed = known - current
+        if removed:
+            deleted = remove_playlist_tracks(conn, cur, playlist_id, removed)
+            print(f"{len(removed)} tracks left the playlist ({deleted} songs deleted).")
+
+    # Only the added tracks need their artists looked up
+    tracks = [track for position, track in pending]
+    artists = resolve_artists(token, tracks)
+
+    rows = []
+    for position, song in pending:
+        row = build_song_row(song, artists)
+        row["position"] = position
+        rows.append(row)
+
+        print(f"{position + 1}. {row['artist_name']} | {row['song_name']} | "
+              f"Popularity: {row['popularity']} | Genre: {row['genre_name']}")
+
+    # New artists, new genres and the songs go in as one bulk write
+    fill_playlist_artist_ids(cur, playlist_id, known_artists)
+    inserted = store_songs(conn, cur, rows, artist_map, genre_map, playlist_id=playlist_id)
+    conn.commit()
+
+    # Keep the popularity of every artist on the playlist as a snapshot
+    # for trend queries
+    record_playlist_popularity(token, conn, cur, playlist_id)
+
+    save_ingest_state(conn, cur, playlist_id, snapshot_id, cursor, total)
+    return inserted
+
+#--------------------------------------------------------------------------------------------
+# Main code to test the functions
+
+def main():
+    token = get_token()
+    playlist_name = "old songs(2000-2017)"
+    playlist_id = resolve_playlist_id(token, playlist_name)
+    if playlist_id is None:
+        return
+    print(f"Playlist: {playlist_name} ({playlist_id})\n")
+
+
+    # ------------------ DATABASE SETUP -------------------------------------------------------------
+    # Tables, indexes and PRAGMAs are owned by schema.py
+    conn = schema.connect("music_data.db")
+    cur = conn.cursor()
+
+    # Name-to-ID maps, loaded once so songs can be resolved without queries
+    artist_map, genre_map = load_id_maps(cur)
+
+    ingest_playlist(token, conn, cur, playlist_id, artist_map, genre_map)
+
+    conn.close()
+
+    response_cache.print_stats()
+    response_cache.close()
+    name_cache.print_stats()
+    name_cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,25 @@
-import sqlite3
-import matplotlib.pyplot as plt
-
-# Connect to database
-conn = sqlite3.connect("music_data.db")
-cur = conn.cursor()
-
-# Query with JOIN
-cur.execute("""
-    SELECT g.genre_name, COUNT(*) as count
-    FROM Songs s
-    JOIN Genres g ON s.genre_id = g.genre_id
-    GROUP BY g.genre_name
-""")
-results = cur.fetchall()
-
-# Prepare data
-genres = [row[0] for row in results]
-counts = [row[1] for row in results]
-
-# Bar graph
-colors = ['red', 'orange', 'yellow', 'green', 'blue', 'purple', 
-          'lightcoral', 'peachpuff', 'wheat', 'lightgreen', 'lightblue', 'plum',
-          'darkred', 'darkorange', 'gold', 'darkgreen', 'darkblue', 'indigo', 'grey']
-plt.bar(genres, counts, color=colors[:len(genres)])
-plt.xlabel("Genre")
-plt.ylabel("Number of Songs")
-plt.title("Number of Songs per Genre in Billboard Top 100")
-plt.xticks(rotation=45, ha='right')
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+import schema
+from report_engine import ReportEngine
+
+DB_NAME = "music_data.db"
+
+
+def plot_genre_counts(cur, filename="spotify_genre_counts.png", engine=None):
+    # Bar graph of songs per genre, drawn by the report engine's PNG sink
+    if engine is None:
+        engine = ReportEngine(cur.connection)
+    engine.render("genres", {"png": filename})
+
+    print(f"Genre chart written to {filename}")
+
+
+def main():
+    # Connect to database
+    conn = schema.connect(DB_NAME)
+    cur = conn.cursor()
+    plot_genre_counts(cur)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
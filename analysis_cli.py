@@ -0,0 +1,123 @@
+"""
+One entry point for the reports, safe to run from cron on a headless box.
+
+    python analysis_cli.py genres                 # Spotify_Calculations.txt
+    python analysis_cli.py genres --format txt,csv,json,png
+    python analysis_cli.py buckets --edges 1,11,26,51,101,251
+    python analysis_cli.py charts --out-dir charts
+    python analysis_cli.py --timing buckets       # report start-up cost
+
+matplotlib is only loaded when a PNG is written (Agg backend, files
+only); the text reports never import it.
+"""
+
+import time
+
+# Taken before the other imports so --timing includes them
+STARTED = time.perf_counter()
+
+import argparse
+import os
+import sys
+
+import schema
+import analyze_lastfm
+from buckets import DEFAULT_BUCKET_EDGES, parse_edges
+from report_engine import SINKS, ReportEngine, default_outputs
+
+DB_NAME = "music_data.db"
+
+IMPORTS_DONE = time.perf_counter()
+
+
+def run_genres(cur, args):
+    # One query, written in every requested format
+    os.makedirs(args.out_dir, exist_ok=True)
+    outputs = default_outputs("genres", args.format, args.out_dir)
+    if args.output and "txt" in outputs:
+        outputs["txt"] = args.output
+    ReportEngine(cur.connection).render("genres", outputs)
+    print("Genre report written to " + ", ".join(outputs.values()))
+
+
+def run_buckets(cur, args):
+    bucket_avgs, bucket_counts = analyze_lastfm.compute_bucket_stats_in_db(cur, args.edges)
+    analyze_lastfm.write_bucket_results_to_file(
+        bucket_avgs, bucket_counts, args.output or "lastfm_bucket_results.txt")
+
+    print("Bucket\tArtists\tAvg Plays per Listener")
+    for bucket in bucket_avgs:
+        print(bucket + "\t" + str(bucket_counts[bucket]) + "\t" +
+              "{0:.3f}".format(bucket_avgs[bucket]))
+
+
+def run_charts(cur, args):
+    # Imported here so the text commands never load the process pool code
+    import chart_render
+
+    specs = chart_render.genre_chart_specs(cur)
+    specs += chart_render.bucket_chart_specs(cur, args.edges, args.snapshots)
+    rendered, skipped = chart_render.render_charts(specs, args.out_dir, args.workers)
+    print("Rendered {0} charts in {1}, skipped {2} unchanged.".format(
+        len(rendered), args.out_dir, len(skipped)))
+
+
+COMMANDS = {
+    "genres": run_genres,
+    "buckets": run_buckets,
+    "charts": run_charts,
+}
+
+
+def print_timing(parsed, finished):
+    print("Timing (ms): imports {0:.1f}, setup {1:.1f}, command {2:.1f}, total {3:.1f}".format(
+        (IMPORTS_DONE - STARTED) * 1000,
+        (parsed - IMPORTS_DONE) * 1000,
+        (finished - parsed) * 1000,
+        (finished - STARTED) * 1000), file=sys.stderr)
+    print("matplotlib loaded: " + str("matplotlib" in sys.modules), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text reports and charts from music_data.db.")
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--timing", action="store_true",
+                        help="print start-up and run time to stderr")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    genres = subparsers.add_parser("genres", help="genre percentage report")
+    genres.add_argument("--output", help="text report file (default Spotify_Calculations.txt)")
+    genres.add_argument("--format", type=lambda text: [fmt for fmt in text.split(",") if fmt],
+                        default=["txt"], help="comma-separated: " + ",".join(SINKS))
+    genres.add_argument("--out-dir", default=".")
+
+    buckets = subparsers.add_parser("buckets", help="Last.fm plays per listener by rank bucket")
+    buckets.add_argument("--output", help="report file (default lastfm_bucket_results.txt)")
+
+    charts = subparsers.add_parser("charts", help="write the PNG charts")
+    charts.add_argument("--out-dir", default=".")
+    charts.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    charts.add_argument("--snapshots", type=int, default=24,
+                        help="how many recent Last.fm snapshots to chart")
+
+    for subparser in (buckets, charts):
+        subparser.add_argument("--edges", type=parse_edges, default=DEFAULT_BUCKET_EDGES,
+                               help="rank bucket edges, e.g. 1,11,26,51,101")
+
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    cur = conn.cursor()
+    parsed = time.perf_counter()
+
+    try:
+        COMMANDS[args.command](cur, args)
+    finally:
+        conn.close()
+
+    if args.timing:
+        print_timing(parsed, time.perf_counter())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,61 @@
-import sqlite3
-import matplotlib.pyplot as plt
+import schema
+from buckets import (DEFAULT_BUCKET_EDGES, bucket_index, bucket_labels,
+                     bucket_totals_to_stats, merge_bucket_totals, numpy_bucket_stats,
+                     numpy_bucket_totals, sql_bucket_stats)
+from plotting import get_pyplot
 
 DB_NAME = "lastfm_data.db"
 
+# Rows aggregated at a time when reading memory-mapped columns
+COLUMN_SLICE_ROWS = 4000000
+
 
 def get_connection():
-    conn = sqlite3.connect(DB_NAME)
+    conn = schema.connect(DB_NAME)
     cur = conn.cursor()
     return conn, cur
 
 
 def get_lastfm_top_artists(cur):
     """
-    Get up to 100 artists ordered by rank.
+    Get every artist on the current chart, ordered by rank. Artists that
+    fell off the chart have a NULL rank and are left out.
     Returns a list of (artist_name, listeners, playcount, rank).
     """
     cur.execute("""
         SELECT artist_name, listeners, playcount, rank
         FROM LastfmTopArtists
+        WHERE rank IS NOT NULL
         ORDER BY rank ASC
-        LIMIT 100
     """)
     rows = cur.fetchall()
     return rows
 
 
-def get_bucket_label(rank):
+def get_bucket_label(rank, edges=DEFAULT_BUCKET_EDGES):
+    """
+    Return a string label for the rank bucket, or None for ranks below
+    the first edge.
+    """
+    index = bucket_index(rank, edges)
+    if index is None:
+        return None
+    return bucket_labels(edges)[index]
+
+
+def stats_to_dicts(stats):
     """
-    Return a string label for the rank bucket.
+    Split bucket stats into (bucket_avgs, bucket_counts), both in rank order.
     """
-    if rank >= 1 and rank <= 10:
-        return "1-10"
-    elif rank >= 11 and rank <= 25:
-        return "11-25"
-    elif rank >= 26 and rank <= 50:
-        return "26-50"
-    else:
-        return "51-100"
+    bucket_avgs = {}
+    bucket_counts = {}
+    for stat in stats:
+        bucket_avgs[stat["bucket"]] = stat["mean"]
+        bucket_counts[stat["bucket"]] = stat["count"]
+    return bucket_avgs, bucket_counts
 
 
-def compute_avg_plays_per_listener_by_bucket(rows):
+def compute_avg_plays_per_listener_by_bucket(rows, edges=DEFAULT_BUCKET_EDGES):
     """
     rows: list of (artist_name, listeners, playcount, rank)
 
@@ -47,40 +63,42 @@ def compute_avg_plays_per_listener_by_bucket(rows):
       bucket_avgs: dict {bucket_label: average_ratio}
       bucket_counts: dict {bucket_label: number_of_artists}
     """
-    sum_ratios = {}
-    counts = {}
+    listeners = [row[1] for row in rows]
+    playcounts = [row[2] for row in rows]
+    ranks = [row[3] for row in rows]
+    return stats_to_dicts(numpy_bucket_stats(ranks, listeners, playcounts, edges))
 
-    for row in rows:
-        artist_name = row[0]
-        listeners = row[1]
-        playcount = row[2]
-        rank = row[3]
 
-        # Avoid division by zero
-        if listeners == 0:
-            continue
+def compute_bucket_stats_in_db(cur, edges=DEFAULT_BUCKET_EDGES):
+    """
+    Same result as compute_avg_plays_per_listener_by_bucket, but computed
+    by SQLite without reading the rows into Python.
+    """
+    return stats_to_dicts(sql_bucket_stats(cur, edges))
 
-        ratio = float(playcount) / float(listeners)
-        bucket = get_bucket_label(rank)
 
-        if bucket in sum_ratios:
-            sum_ratios[bucket] = sum_ratios[bucket] + ratio
-            counts[bucket] = counts[bucket] + 1
-        else:
-            sum_ratios[bucket] = ratio
-            counts[bucket] = 1
+def compute_bucket_stats_from_columns(columnar_dir, edges=DEFAULT_BUCKET_EDGES,
+                                      table="lastfm_top_artists",
+                                      slice_rows=COLUMN_SLICE_ROWS):
+    """
+    Same result as compute_avg_plays_per_listener_by_bucket, read from a
+    columnar_export.py export instead of the database. The columns are
+    memory-mapped and aggregated slice by slice, so memory use stays flat
+    however many snapshot rows there are.
 
-    bucket_avgs = {}
-    for bucket in sum_ratios:
-        total_ratio = sum_ratios[bucket]
-        count = counts[bucket]
-        if count > 0:
-            avg = total_ratio / float(count)
-        else:
-            avg = 0.0
-        bucket_avgs[bucket] = avg
+    table: "lastfm_top_artists", or "lastfm_snapshots" for all history
+    """
+    from columnar_export import ColumnStore
 
-    return bucket_avgs, counts
+    totals = None
+    for chunk in ColumnStore(columnar_dir).chunks(table, ("rank", "listeners", "playcount")):
+        rows = len(chunk["rank"])
+        for start in range(0, rows, slice_rows):
+            end = start + slice_rows
+            totals = merge_bucket_totals(totals, numpy_bucket_totals(
+                chunk["rank"][start:end], chunk["listeners"][start:end],
+                chunk["playcount"][start:end], edges))
+    return stats_to_dicts(bucket_totals_to_stats(totals, edges))
 
 
 def write_bucket_results_to_file(bucket_avgs, bucket_counts,
@@ -89,11 +107,11 @@ def write_bucket_results_to_file(bucket_avgs, bucket_counts,
     Write the average plays per listener by bucket to a text file.
     """
     with open(filename, "w") as f:
-        f.write("Last.fm Top 100 Artists — Plays per Listener by Rank Bucket\n\n")
+        f.write("Last.fm Top Artists — Plays per Listener by Rank Bucket\n\n")
         f.write("Bucket\tArtists\tAvg Plays per Listener\n")
 
+        # Dicts are already in rank order
         buckets = list(bucket_avgs.keys())
-        buckets.sort()  # sorts strings like "1-10", "11-25", etc.
 
         for bucket in buckets:
             avg = bucket_avgs[bucket]
@@ -104,32 +122,32 @@ def write_bucket_results_to_file(bucket_avgs, bucket_counts,
             f.write(line)
 
 
-def plot_bucket_bar_chart(bucket_avgs):
+def plot_bucket_bar_chart(bucket_avgs,
+                          filename="lastfm_bucket_plays_per_listener.png"):
     """
     Bar chart: x = bucket label, y = average plays per listener.
     """
     buckets = list(bucket_avgs.keys())
-    buckets.sort()
 
     values = []
     for bucket in buckets:
         values.append(bucket_avgs[bucket])
 
+    plt = get_pyplot()
     plt.figure()
     plt.bar(buckets, values)
-    plt.title("Last.fm Top 100 Artists:\nAverage Plays per Listener by Rank Bucket")
+    plt.title("Last.fm Top Artists:\nAverage Plays per Listener by Rank Bucket")
     plt.xlabel("Rank bucket")
     plt.ylabel("Average plays per listener")
     plt.tight_layout()
-    plt.savefig("lastfm_bucket_plays_per_listener.png")
+    plt.savefig(filename)
     plt.close()
 
 
 def main():
     conn, cur = get_connection()
 
-    rows = get_lastfm_top_artists(cur)
-    bucket_avgs, bucket_counts = compute_avg_plays_per_listener_by_bucket(rows)
+    bucket_avgs, bucket_counts = compute_bucket_stats_in_db(cur)
 
     write_bucket_results_to_file(bucket_avgs, bucket_counts)
     plot_bucket_bar_chart(bucket_avgs)
@@ -0,0 +1,268 @@
+"""
+Match Last.fm chart artists to Spotify artists in music_data.db.
+
+    python artist_matching.py               # match artists added since the last run
+    python artist_matching.py --rebuild     # forget everything and match again
+    python artist_matching.py --list 20
+
+Names are reduced to a key (accents, case, "feat." credits, "&"/"and",
+a leading "The" and punctuation removed), stored in ArtistKeys. Equal
+keys are exact matches. Otherwise candidates come from an inverted index
+of character trigrams, so each name is only compared with the names it
+shares trigrams with, and the best one is kept if its Dice similarity
+reaches the threshold. Matches go to ArtistMatches.
+
+Each run only looks at artists that have no ArtistKeys row yet: new
+Last.fm artists are matched against all Spotify artists, and new Spotify
+artists against the Last.fm artists that still lack an exact match.
+"""
+
+import argparse
+import re
+import time
+import unicodedata
+
+import schema
+from chart_history import LASTFM, SPOTIFY
+
+DB_NAME = "music_data.db"
+
+# Minimum Dice similarity of trigram sets for a fuzzy match
+DEFAULT_THRESHOLD = 0.8
+
+NGRAM_SIZE = 3
+
+# (table, id column, name column) per source
+SOURCE_TABLES = {
+    SPOTIFY: ("Artists", "artist_id", "artist_name"),
+    LASTFM: ("LastfmTopArtists", "artist_id", "artist_name"),
+}
+
+# "feat."/"ft."/"featuring" credits, or "with" only inside brackets so
+# names such as "Sleeping With Sirens" keep their second half
+FEATURING = re.compile(
+    r"\s+(?:[\(\[]\s*(?:feat|ft|featuring|with)|feat|ft|featuring)\b.*$")
+AMPERSAND = re.compile(r"\s*(&|\+)\s*")
+NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_name(name):
+    """
+    "Beyoncé feat. JAY-Z" -> "beyonce", "The Beatles" -> "beatles",
+    "Simon & Garfunkel" -> "simonandgarfunkel",
+    "Sleeping With Sirens" -> "sleepingwithsirens",
+    "Dance With the Dead" -> "dancewiththedead",
+    "Drake (with Future)" -> "drake".
+    """
+    text = unicodedata.normalize("NFKD", name)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.casefold()
+    text = FEATURING.sub("", text)
+    text = AMPERSAND.sub(" and ", text)
+    words = NON_WORD.sub(" ", text).split()
+    if len(words) > 1 and words[0] == "the":
+        words = words[1:]
+    key = "".join(words)
+    if not key:
+        # Names made only of symbols keep their casefolded text
+        key = name.strip().casefold()
+    return key
+
+
+def ngrams(key, size=NGRAM_SIZE):
+    padded = "^" + key + "$"
+    if len(padded) <= size:
+        return {padded}
+    return set(padded[i:i + size] for i in range(len(padded) - size + 1))
+
+
+class NGramIndex:
+    """
+    Inverted index from trigram to the IDs whose key contains it.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.grams = {}
+        self.by_key = {}
+
+    def add(self, item_id, key):
+        grams = ngrams(key)
+        self.grams[item_id] = grams
+        self.by_key.setdefault(key, []).append(item_id)
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(item_id)
+
+    def best_match(self, key, threshold):
+        """
+        Return (item_id, score, method) for the closest key, or None.
+        """
+        exact = self.by_key.get(key)
+        if exact:
+            return min(exact), 1.0, "exact"
+
+        grams = ngrams(key)
+        shared = {}
+        for gram in grams:
+            for item_id in self.postings.get(gram, ()):
+                shared[item_id] = shared.get(item_id, 0) + 1
+
+        best = None
+        for item_id, count in shared.items():
+            score = 2.0 * count / (len(grams) + len(self.grams[item_id]))
+            if score < threshold:
+                continue
+            if best is None or score > best[1] or (score == best[1] and item_id < best[0]):
+                best = (item_id, score, "fuzzy")
+        return best
+
+
+def load_keys(cur, source):
+    cur.execute("SELECT artist_id, name_key FROM ArtistKeys WHERE source = ?", (source,))
+    return dict(cur.fetchall())
+
+
+def add_new_keys(cur, source):
+    """
+    Store keys for artists of source that have none yet.
+    Returns {artist_id: name_key} for those artists.
+    """
+    table, id_column, name_column = SOURCE_TABLES[source]
+    cur.execute(
+        "SELECT t." + id_column + ", t." + name_column + " FROM " + table + " t "
+        "WHERE t." + name_column + " IS NOT NULL AND NOT EXISTS ("
+        "SELECT 1 FROM ArtistKeys k WHERE k.source = ? AND k.artist_id = t." + id_column + ")",
+        (source,)
+    )
+    new_keys = {}
+    for artist_id, name in cur.fetchall():
+        new_keys[artist_id] = normalize_name(name)
+
+    cur.executemany(
+        "INSERT INTO ArtistKeys (source, artist_id, name_key) VALUES (?, ?, ?)",
+        [(source, artist_id, key) for artist_id, key in new_keys.items()]
+    )
+    return new_keys
+
+
+def build_index(keys):
+    index = NGramIndex()
+    for item_id, key in keys.items():
+        index.add(item_id, key)
+    return index
+
+
+def match_artists(conn, cur, threshold=DEFAULT_THRESHOLD):
+    """
+    Match the artists added since the last run and store the results.
+    Returns (new_spotify, new_lastfm, matches_written).
+    """
+    new_spotify = add_new_keys(cur, SPOTIFY)
+    new_lastfm = add_new_keys(cur, LASTFM)
+
+    cur.execute("SELECT lastfm_artist_id, score FROM ArtistMatches")
+    scores = dict(cur.fetchall())
+    found = {}
+
+    # New Last.fm artists against every Spotify artist
+    if new_lastfm:
+        spotify_index = build_index(load_keys(cur, SPOTIFY))
+        for lastfm_id, key in new_lastfm.items():
+            match = spotify_index.best_match(key, threshold)
+            if match is not None:
+                found[lastfm_id] = match
+
+    # New Spotify artists against Last.fm artists without an exact match
+    if new_spotify:
+        open_lastfm = {}
+        for lastfm_id, key in load_keys(cur, LASTFM).items():
+            if lastfm_id in found or scores.get(lastfm_id, 0.0) >= 1.0:
+                continue
+            open_lastfm[lastfm_id] = key
+        lastfm_index = build_index(open_lastfm)
+
+        for spotify_id, key in new_spotify.items():
+            exact = lastfm_index.by_key.get(key, [])
+            candidates = [(lastfm_id, 1.0, "exact") for lastfm_id in exact]
+            if not candidates:
+                match = lastfm_index.best_match(key, threshold)
+                if match is not None:
+                    candidates = [match]
+            for lastfm_id, score, method in candidates:
+                current = found.get(lastfm_id)
+                if score <= scores.get(lastfm_id, 0.0):
+                    continue
+                if current is None or score > current[1]:
+                    found[lastfm_id] = (spotify_id, score, method)
+
+    now = int(time.time())
+    cur.executemany("""
+        INSERT INTO ArtistMatches (lastfm_artist_id, spotify_artist_id, score, method, matched_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(lastfm_artist_id) DO UPDATE SET
+            spotify_artist_id = excluded.spotify_artist_id,
+            score = excluded.score,
+            method = excluded.method,
+            matched_at = excluded.matched_at
+    """, [(lastfm_id, spotify_id, score, method, now)
+          for lastfm_id, (spotify_id, score, method) in found.items()])
+    conn.commit()
+    return len(new_spotify), len(new_lastfm), len(found)
+
+
+def reset_matches(conn, cur):
+    cur.execute("DELETE FROM ArtistMatches")
+    cur.execute("DELETE FROM ArtistKeys")
+    conn.commit()
+
+
+def list_matches(cur, limit=20):
+    """
+    Matched artists in Last.fm rank order:
+    (rank, lastfm_name, spotify_name, score, method).
+    """
+    cur.execute("""
+        SELECT l.rank, l.artist_name, a.artist_name, m.score, m.method
+        FROM ArtistMatches m
+        JOIN LastfmTopArtists l ON l.artist_id = m.lastfm_artist_id
+        JOIN Artists a ON a.artist_id = m.spotify_artist_id
+        ORDER BY l.rank
+        LIMIT ?
+    """, (limit,))
+    return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match Last.fm artists to Spotify artists.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="minimum trigram similarity for a fuzzy match (0-1)")
+    parser.add_argument("--rebuild", action="store_true", help="drop all keys and matches first")
+    parser.add_argument("--list", type=int, default=0, metavar="N", help="print the top N matches")
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    cur = conn.cursor()
+
+    if args.rebuild:
+        reset_matches(conn, cur)
+
+    started = time.perf_counter()
+    new_spotify, new_lastfm, written = match_artists(conn, cur, args.threshold)
+    elapsed = time.perf_counter() - started
+
+    cur.execute("SELECT COUNT(*) FROM ArtistMatches")
+    total = cur.fetchone()[0]
+    print("Looked at {0} new Spotify and {1} new Last.fm artists, wrote {2} matches "
+          "({3} in total) in {4:.1f} ms.".format(new_spotify, new_lastfm, written, total,
+                                                 elapsed * 1000))
+
+    for rank, lastfm_name, spotify_name, score, method in list_matches(cur, args.list):
+        print(str(rank) + "\t" + lastfm_name + "\t" + spotify_name + "\t" +
+              "{0:.2f}".format(score) + "\t" + method)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Benchmarks for the ingest and analysis paths on synthetic data.
+
+    python benchmark.py --sizes 1000,100000,1000000 --output bench.json
+    python benchmark.py --sizes 10000000 --only genres,buckets_sql --repeat 1
+
+For every size N a fresh database is generated in a temporary directory
+with N Songs, N/10 Artists, N LastfmArtistSnapshots rows (over as many
+snapshots as needed) and min(N, 100000) LastfmTopArtists. Each benchmark
+is timed --repeat times and the fastest run is kept. Results are written
+as JSON with the commit, Python and SQLite versions, so files from
+different commits can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+import schema
+import store_lastfm
+from analyze_lastfm import compute_avg_plays_per_listener_by_bucket, get_lastfm_top_artists
+from buckets import sql_bucket_stats
+from chart_history import LASTFM
+from report_engine import genre_distribution
+from store_spotify import load_id_maps, store_songs
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+MAX_SIZE = 10 ** 7
+
+GENRE_COUNT = 50
+LASTFM_ARTIST_LIMIT = 100000
+LASTFM_ARTISTS_PER_SNAPSHOT = 1000
+
+# Spotify_Data.BATCH_SIZE; not imported so the benchmark needs no API setup
+INGEST_BATCH_SIZE = 25
+
+SEED = 1234
+
+
+# ---------------------------------------------------------------- data
+
+def synthetic_songs(count, artist_count, rng):
+    for i in range(count):
+        yield {
+            "song_name": "song %d" % i,
+            "artist_name": "artist %d" % rng.randrange(artist_count),
+            "popularity": rng.randrange(101),
+            "genre_name": "genre %d" % rng.randrange(GENRE_COUNT)
+        }
+
+
+def synthetic_chart(count, rng):
+    artists = []
+    for i in range(count):
+        listeners = rng.randrange(1000, 5000000)
+        artists.append({
+            "artist_name": "lastfm artist %d" % i,
+            "listeners": listeners,
+            "playcount": listeners * rng.randrange(1, 300),
+            "rank": i + 1
+        })
+    return artists
+
+
+def generate(db_name, size, seed=SEED):
+    """
+    Build a database with `size` songs and snapshot rows, written straight
+    with executemany (this is set-up, not one of the timed paths).
+    """
+    rng = random.Random(seed)
+    conn = schema.connect(db_name)
+    cur = conn.cursor()
+    artist_count = max(1, size // 10)
+
+    cur.executemany("INSERT INTO Genres (genre_id, genre_name) VALUES (?, ?)",
+                    (((i + 1), "genre %d" % i) for i in range(GENRE_COUNT)))
+    cur.executemany("INSERT INTO Artists (artist_id, artist_name) VALUES (?, ?)",
+                    (((i + 1), "artist %d" % i) for i in range(artist_count)))
+    cur.executemany(
+        "INSERT INTO Songs (song_name, artist_id, popularity, genre_id) VALUES (?, ?, ?, ?)",
+        (("song %d" % i, rng.randrange(artist_count) + 1, rng.randrange(101),
+          rng.randrange(GENRE_COUNT) + 1) for i in range(size))
+    )
+
+    chart = synthetic_chart(min(size, LASTFM_ARTIST_LIMIT), rng)
+    cur.executemany(
+        "INSERT INTO LastfmTopArtists (artist_name, listeners, playcount, rank) VALUES (?, ?, ?, ?)",
+        ((a["artist_name"], a["listeners"], a["playcount"], a["rank"]) for a in chart)
+    )
+    cur.execute("INSERT INTO LastfmArtists (artist_id, artist_name) "
+                "SELECT artist_id, artist_name FROM LastfmTopArtists")
+
+    per_snapshot = min(size, LASTFM_ARTISTS_PER_SNAPSHOT)
+    snapshots = (size + per_snapshot - 1) // per_snapshot
+    started = int(time.time()) - snapshots * 3600
+    cur.executemany("INSERT INTO ChartSnapshots (snapshot_id, source, fetched_at) VALUES (?, ?, ?)",
+                    ((i + 1, LASTFM, started + i * 3600) for i in range(snapshots)))
+
+    def snapshot_rows():
+        for i in range(size):
+            snapshot_id = i // per_snapshot + 1
+            rank = i % per_snapshot + 1
+            listeners = rng.randrange(1000, 5000000)
+            yield (rank, snapshot_id, rank, listeners, listeners * rng.randrange(1, 300))
+
+    cur.executemany(
+        "INSERT INTO LastfmArtistSnapshots (artist_id, snapshot_id, rank, listeners, playcount) "
+        "VALUES (?, ?, ?, ?, ?)",
+        snapshot_rows()
+    )
+    conn.commit()
+    cur.execute("ANALYZE")
+    conn.commit()
+    return conn
+
+
+# ---------------------------------------------------------- benchmarks
+
+def bench_ingest(workdir, size, rng):
+    # The Spotify write path: store_songs in ingest-sized batches
+    db_name = os.path.join(workdir, "ingest.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_name + suffix):
+            os.remove(db_name + suffix)
+    conn = schema.connect(db_name)
+    cur = conn.cursor()
+    artist_map, genre_map = load_id_maps(cur)
+    songs = list(synthetic_songs(size, max(1, size // 10), rng))
+
+    started = time.perf_counter()
+    for start in range(0, len(songs), INGEST_BATCH_SIZE):
+        store_songs(conn, cur, songs[start:start + INGEST_BATCH_SIZE], artist_map, genre_map)
+    elapsed = time.perf_counter() - started
+
+    conn.close()
+    return elapsed
+
+
+def bench_store_lastfm(workdir, size, rng):
+    # store_lastfm_data with chart pages generated in-process instead of
+    # fetched, so only the paging, upsert and snapshot work is timed
+    db_name = os.path.join(workdir, "lastfm.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_name + suffix):
+            os.remove(db_name + suffix)
+    conn = schema.connect(db_name)
+    cur = conn.cursor()
+
+    depth = min(size, LASTFM_ARTIST_LIMIT)
+    chart = synthetic_chart(depth, rng)
+
+    def chart_page(page, limit=store_lastfm.LASTFM_PAGE_SIZE):
+        return chart[(page - 1) * limit:page * limit]
+
+    fetch_page = store_lastfm.fetch_lastfm_chart_page
+    store_lastfm.fetch_lastfm_chart_page = chart_page
+    try:
+        started = time.perf_counter()
+        store_lastfm.store_lastfm_data(conn, cur, depth=depth, max_new_per_run=None)
+        elapsed = time.perf_counter() - started
+    finally:
+        store_lastfm.fetch_lastfm_chart_page = fetch_page
+        conn.close()
+    return elapsed
+
+
+def bench_genres_scan(conn):
+    # The original full JOIN/GROUP BY plus COUNT(*) over Songs
+    cur = conn.cursor()
+    started = time.perf_counter()
+    cur.execute("""
+        SELECT g.genre_name, COUNT(*)
+        FROM Songs s
+        JOIN Genres g ON s.genre_id = g.genre_id
+        GROUP BY g.genre_name
+    """)
+    cur.fetchall()
+    cur.execute("SELECT COUNT(*) FROM Songs")
+    cur.fetchone()
+    return time.perf_counter() - started
+
+
+def bench_genres(conn):
+    # The report path, reading GenreStats
+    started = time.perf_counter()
+    genre_distribution(conn.cursor())
+    return time.perf_counter() - started
+
+
+def bench_buckets_python(conn):
+    # Read every artist, then bucket in Python/NumPy
+    started = time.perf_counter()
+    compute_avg_plays_per_listener_by_bucket(get_lastfm_top_artists(conn.cursor()))
+    return time.perf_counter() - started
+
+
+def bench_buckets_sql(conn):
+    # One GROUP BY over every snapshot row
+    started = time.perf_counter()
+    sql_bucket_stats(conn.cursor(), table="LastfmArtistSnapshots")
+    return time.perf_counter() - started
+
+
+# name -> (function, rows it touches for a database of size N)
+WRITE_BENCHMARKS = {
+    "ingest": (bench_ingest, lambda size: size),
+    "store_lastfm": (bench_store_lastfm, lambda size: min(size, LASTFM_ARTIST_LIMIT)),
+}
+READ_BENCHMARKS = {
+    "genres_scan": (bench_genres_scan, lambda size: size),
+    "genres": (bench_genres, lambda size: GENRE_COUNT),
+    "buckets_python": (bench_buckets_python, lambda size: min(size, LASTFM_ARTIST_LIMIT)),
+    "buckets_sql": (bench_buckets_sql, lambda size: size),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, names, repeat, workdir):
+    results = []
+    for size in sizes:
+        rng = random.Random(SEED)
+        db_name = os.path.join(workdir, "bench_%d.db" % size)
+
+        started = time.perf_counter()
+        conn = generate(db_name, size)
+        print("size {0}: generated in {1:.1f}s".format(size, time.perf_counter() - started))
+
+        for name in names:
+            if name in WRITE_BENCHMARKS:
+                fn, rows_for = WRITE_BENCHMARKS[name]
+                times = [fn(workdir, size, rng) for _ in range(repeat)]
+            else:
+                fn, rows_for = READ_BENCHMARKS[name]
+                times = [fn(conn) for _ in range(repeat)]
+
+            best = min(times)
+            rows = rows_for(size)
+            results.append({
+                "benchmark": name,
+                "size": size,
+                "rows": rows,
+                "seconds": best,
+                "runs": times,
+                "rows_per_second": rows / best if best > 0 else None
+            })
+            print("  {0:<16}{1:>12.4f}s {2:>14,.0f} rows/s".format(
+                name, best, rows / best if best > 0 else 0))
+
+        conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_name + suffix):
+                os.remove(db_name + suffix)
+    return results
+
+
+def parse_sizes(text):
+    sizes = [int(float(part)) for part in text.split(",") if part.strip()]
+    for size in sizes:
+        if size < 1 or size > MAX_SIZE:
+            raise argparse.ArgumentTypeError("sizes must be between 1 and %d" % MAX_SIZE)
+    return sizes
+
+
+def main():
+    all_names = list(WRITE_BENCHMARKS) + list(READ_BENCHMARKS)
+
+    parser = argparse.ArgumentParser(description="Benchmark ingest and analysis on synthetic data.")
+    parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES,
+                        help="comma-separated row counts, e.g. 1e3,1e5,1e7")
+    parser.add_argument("--only", help="comma-separated subset of: " + ",".join(all_names))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--workdir", help="where to build the databases (default: a temp dir)")
+    args = parser.parse_args()
+
+    names = all_names
+    if args.only:
+        names = [name.strip() for name in args.only.split(",") if name.strip()]
+        for name in names:
+            if name not in all_names:
+                parser.error("unknown benchmark: " + name)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="music_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = run(args.sizes, names, max(1, args.repeat), workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Rank buckets for the Last.fm analysis.
+
+A bucket scheme is a list of increasing edges. Bucket i holds the ranks
+edges[i] <= rank < edges[i + 1], and ranks at or past the last edge go in
+an open-ended "N+" bucket. The default [1, 11, 26, 51, 101] gives
+1-10, 11-25, 26-50, 51-100 and 101+.
+
+Stats can be computed two ways, with the same result:
+  sql_bucket_stats    one GROUP BY inside SQLite, nothing per row in Python
+  numpy_bucket_stats  searchsorted + bincount over column arrays
+Both return buckets in rank order, not string order.
+"""
+
+from bisect import bisect_right
+
+DEFAULT_BUCKET_EDGES = [1, 11, 26, 51, 101]
+
+# Tables with rank, listeners and playcount columns
+RANKED_TABLES = ("LastfmTopArtists", "LastfmArtistSnapshots")
+
+
+def check_edges(edges):
+    """
+    Return edges as a list of ints, or raise ValueError if they are not
+    strictly increasing.
+    """
+    edges = [int(edge) for edge in edges]
+    if not edges:
+        raise ValueError("need at least one bucket edge")
+    for i in range(1, len(edges)):
+        if edges[i] <= edges[i - 1]:
+            raise ValueError("bucket edges must be strictly increasing: " + str(edges))
+    return edges
+
+
+def parse_edges(text):
+    """
+    Parse "1,11,26,51,101" into a list of edges.
+    """
+    return check_edges(part for part in text.split(",") if part.strip())
+
+
+def bucket_labels(edges=DEFAULT_BUCKET_EDGES):
+    """
+    Labels for every bucket, in order: ["1-10", ..., "101+"].
+    """
+    edges = check_edges(edges)
+    labels = []
+    for i in range(len(edges) - 1):
+        if edges[i + 1] - 1 == edges[i]:
+            labels.append(str(edges[i]))
+        else:
+            labels.append(str(edges[i]) + "-" + str(edges[i + 1] - 1))
+    labels.append(str(edges[-1]) + "+")
+    return labels
+
+
+def bucket_index(rank, edges=DEFAULT_BUCKET_EDGES):
+    """
+    Index of the bucket rank falls in, or None if it is below the first edge.
+    """
+    index = bisect_right(edges, rank) - 1
+    if index < 0:
+        return None
+    return index
+
+
+def bucket_case_sql(column, edges=DEFAULT_BUCKET_EDGES):
+    """
+    SQL expression giving the bucket index of column (NULL below the first
+    edge). Edges are checked ints, so they are safe to inline.
+    """
+    edges = check_edges(edges)
+    parts = ["CASE"]
+    for i in range(len(edges) - 1, -1, -1):
+        parts.append("WHEN " + column + " >= " + str(edges[i]) + " THEN " + str(i))
+    parts.append("END")
+    return " ".join(parts)
+
+
+def _stats_rows(edges, results):
+    # results: (index, count, mean, min, max, listeners, playcount) per
+    # non-empty bucket, in index order
+    labels = bucket_labels(edges)
+    stats = []
+    for index, count, mean, low, high, listeners, playcount in results:
+        stats.append({
+            "bucket": labels[index],
+            "index": index,
+            "count": count,
+            "mean": mean,
+            "min": low,
+            "max": high,
+            "listeners": listeners,
+            "playcount": playcount
+        })
+    return stats
+
+
+def sql_bucket_stats(cur, edges=DEFAULT_BUCKET_EDGES, table="LastfmTopArtists",
+                     where=None, params=()):
+    """
+    Plays-per-listener stats per rank bucket, as a single GROUP BY.
+
+    table: LastfmTopArtists, or LastfmArtistSnapshots for history
+    where: optional extra SQL condition, e.g. "snapshot_id = ?", with params
+    Artists with no listeners are skipped.
+
+    Returns a list of dicts (bucket, index, count, mean, min, max,
+    listeners, playcount), one per non-empty bucket, in rank order.
+    """
+    if table not in RANKED_TABLES:
+        raise ValueError("not a ranked table: " + table)
+    edges = check_edges(edges)
+
+    condition = "listeners > 0"
+    if where:
+        condition = condition + " AND (" + where + ")"
+
+    cur.execute("""
+        SELECT bucket, COUNT(*), AVG(ratio), MIN(ratio), MAX(ratio),
+               SUM(listeners), SUM(playcount)
+        FROM (
+            SELECT """ + bucket_case_sql("rank", edges) + """ AS bucket,
+                   CAST(playcount AS REAL) / listeners AS ratio,
+                   listeners, playcount
+            FROM """ + table + """
+            WHERE """ + condition + """
+        )
+        WHERE bucket IS NOT NULL
+        GROUP BY bucket
+        ORDER BY bucket
+    """, params)
+    return _stats_rows(edges, cur.fetchall())
+
+
+def load_rank_columns(cur, table="LastfmTopArtists", where=None, params=()):
+    """
+    Read rank, listeners and playcount into three NumPy arrays.
+    """
+    import numpy as np
+
+    if table not in RANKED_TABLES:
+        raise ValueError("not a ranked table: " + table)
+    sql = "SELECT rank, listeners, playcount FROM " + table
+    if where:
+        sql = sql + " WHERE " + where
+    cur.execute(sql, params)
+
+    data = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 3)
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def numpy_bucket_totals(ranks, listeners, playcounts, edges=DEFAULT_BUCKET_EDGES):
+    """
+    Per-bucket partial sums for one slice of rows, as a tuple of arrays
+    (counts, ratio_sums, ratio_mins, ratio_maxes, listener_sums,
+    playcount_sums). Slices can be combined with merge_bucket_totals, so
+    large or memory-mapped columns can be processed a piece at a time.
+    """
+    import numpy as np
+
+    edges = check_edges(edges)
+    ranks = np.asarray(ranks)
+    listeners = np.asarray(listeners)
+    playcounts = np.asarray(playcounts)
+
+    keep = (listeners > 0) & (ranks >= edges[0])
+    ranks = ranks[keep]
+    listeners = listeners[keep].astype(np.float64)
+    playcounts = playcounts[keep].astype(np.float64)
+    ratios = playcounts / listeners
+
+    index = np.searchsorted(np.asarray(edges), ranks, side="right") - 1
+    size = len(edges)
+
+    lows = np.full(size, np.inf)
+    highs = np.full(size, -np.inf)
+    np.minimum.at(lows, index, ratios)
+    np.maximum.at(highs, index, ratios)
+
+    return (np.bincount(index, minlength=size),
+            np.bincount(index, weights=ratios, minlength=size),
+            lows,
+            highs,
+            np.bincount(index, weights=listeners, minlength=size),
+            np.bincount(index, weights=playcounts, minlength=size))
+
+
+def merge_bucket_totals(a, b):
+    import numpy as np
+
+    if a is None:
+        return b
+    return (a[0] + b[0], a[1] + b[1], np.minimum(a[2], b[2]), np.maximum(a[3], b[3]),
+            a[4] + b[4], a[5] + b[5])
+
+
+def bucket_totals_to_stats(totals, edges=DEFAULT_BUCKET_EDGES):
+    """
+    Turn numpy_bucket_totals output into the list sql_bucket_stats returns.
+    """
+    import numpy as np
+
+    edges = check_edges(edges)
+    if totals is None:
+        return []
+    counts, sums, lows, highs, listener_sums, playcount_sums = totals
+
+    results = []
+    for i in np.flatnonzero(counts):
+        results.append((int(i), int(counts[i]), float(sums[i] / counts[i]),
+                        float(lows[i]), float(highs[i]),
+                        int(listener_sums[i]), int(playcount_sums[i])))
+    return _stats_rows(edges, results)
+
+
+def numpy_bucket_stats(ranks, listeners, playcounts, edges=DEFAULT_BUCKET_EDGES):
+    """
+    The same stats as sql_bucket_stats, from column arrays (or lists).
+    """
+    return bucket_totals_to_stats(numpy_bucket_totals(ranks, listeners, playcounts, edges), edges)
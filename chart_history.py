@@ -0,0 +1,255 @@
+import argparse
+import time
+
+import schema
+
+DB_NAME = "music_data.db"
+
+LASTFM = "lastfm"
+SPOTIFY = "spotify"
+
+DAY = 24 * 3600
+
+
+def start_snapshot(cur, source, fetched_at=None):
+    """
+    Add a ChartSnapshots row and return its snapshot_id.
+    """
+    if fetched_at is None:
+        fetched_at = int(time.time())
+    cur.execute("INSERT INTO ChartSnapshots (source, fetched_at) VALUES (?, ?)",
+                (source, int(fetched_at)))
+    return cur.lastrowid
+
+
+def lastfm_artist_ids(cur, names):
+    """
+    Return {artist_name: artist_id} from LastfmArtists for the given names,
+    adding the ones it does not have yet. Does not commit.
+    """
+    names = list(names)
+    cur.executemany("INSERT OR IGNORE INTO LastfmArtists (artist_name) VALUES (?)",
+                    [(name,) for name in names])
+    ids = {}
+    for start in range(0, len(names), 500):
+        chunk = names[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        cur.execute(
+            "SELECT artist_name, artist_id FROM LastfmArtists "
+            "WHERE artist_name IN (" + placeholders + ")",
+            chunk
+        )
+        for name, artist_id in cur.fetchall():
+            ids[name] = artist_id
+    return ids
+
+
+def record_lastfm_snapshot(conn, cur, artists, fetched_at=None):
+    """
+    Record one Last.fm chart fetch.
+    artists: list of dicts with artist_name, listeners, playcount, rank.
+    Every artist gets a row, keyed by its LastfmArtists ID, whether or not
+    LastfmTopArtists has it yet. Returns the snapshot_id.
+    """
+    ids = lastfm_artist_ids(cur, [artist["artist_name"] for artist in artists])
+
+    snapshot_id = start_snapshot(cur, LASTFM, fetched_at)
+
+    rows = []
+    for artist in artists:
+        rows.append((ids[artist["artist_name"]], snapshot_id, artist["rank"],
+                     artist["listeners"], artist["playcount"]))
+
+    cur.executemany(
+        "INSERT OR REPLACE INTO LastfmArtistSnapshots "
+        "(artist_id, snapshot_id, rank, listeners, playcount) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    return snapshot_id
+
+
+def record_spotify_snapshot(conn, cur, popularity_by_artist_id, fetched_at=None):
+    """
+    Record Spotify popularity for the artists seen in one ingest run.
+    popularity_by_artist_id: {Artists.artist_id: popularity}
+    The snapshot and its rows are committed together; a snapshot is never
+    added to later, which columnar_export.py relies on.
+    Returns the snapshot_id, or None if there was nothing to record.
+    """
+    rows = []
+    for artist_id, popularity in popularity_by_artist_id.items():
+        if popularity is not None:
+            rows.append((artist_id, popularity))
+    if not rows:
+        return None
+
+    snapshot_id = start_snapshot(cur, SPOTIFY, fetched_at)
+    cur.executemany(
+        "INSERT OR REPLACE INTO SpotifyArtistSnapshots (artist_id, snapshot_id, popularity) "
+        "VALUES (?, ?, ?)",
+        [(artist_id, snapshot_id, popularity) for artist_id, popularity in rows]
+    )
+    conn.commit()
+    return snapshot_id
+
+
+def latest_snapshot(cur, source, at=None):
+    """
+    Return (snapshot_id, fetched_at) of the newest snapshot of source taken
+    at or before `at` (default: now), or None.
+    """
+    if at is None:
+        at = int(time.time())
+    cur.execute(
+        "SELECT snapshot_id, fetched_at FROM ChartSnapshots "
+        "WHERE source = ? AND fetched_at <= ? "
+        "ORDER BY fetched_at DESC LIMIT 1",
+        (source, int(at))
+    )
+    return cur.fetchone()
+
+
+def snapshot_pair(cur, source, days):
+    """
+    Return (old, new) snapshots for comparing "now" with `days` ago.
+    Each is (snapshot_id, fetched_at); None if there is no such pair.
+    """
+    new = latest_snapshot(cur, source)
+    if new is None:
+        return None
+    old = latest_snapshot(cur, source, new[1] - days * DAY)
+    if old is None:
+        # History is shorter than asked for; compare with the oldest
+        cur.execute(
+            "SELECT snapshot_id, fetched_at FROM ChartSnapshots "
+            "WHERE source = ? ORDER BY fetched_at ASC LIMIT 1",
+            (source,)
+        )
+        old = cur.fetchone()
+    if old[0] == new[0]:
+        return None
+    return old, new
+
+
+def biggest_rank_movers(cur, days=7, limit=10):
+    """
+    Last.fm artists whose rank changed the most over the last `days`.
+    Returns a list of (artist_name, old_rank, new_rank, places_gained).
+    """
+    pair = snapshot_pair(cur, LASTFM, days)
+    if pair is None:
+        return []
+    old, new = pair
+
+    cur.execute("""
+        SELECT a.artist_name, o.rank, n.rank, o.rank - n.rank AS gained
+        FROM LastfmArtistSnapshots n
+        JOIN LastfmArtistSnapshots o
+          ON o.artist_id = n.artist_id AND o.snapshot_id = ?
+        JOIN LastfmArtists a ON a.artist_id = n.artist_id
+        WHERE n.snapshot_id = ?
+        ORDER BY ABS(o.rank - n.rank) DESC, n.rank ASC
+        LIMIT ?
+    """, (old[0], new[0], limit))
+    return cur.fetchall()
+
+
+def playcount_growth(cur, days=7, limit=10):
+    """
+    Last.fm artists with the fastest playcount growth over the last `days`.
+    Returns a list of (artist_name, old_playcount, new_playcount,
+    plays_per_day, percent_growth).
+    """
+    pair = snapshot_pair(cur, LASTFM, days)
+    if pair is None:
+        return []
+    old, new = pair
+    elapsed_days = max((new[1] - old[1]) / float(DAY), 1.0 / 24)
+
+    cur.execute("""
+        SELECT a.artist_name, o.playcount, n.playcount,
+               (n.playcount - o.playcount) / ? AS per_day,
+               CASE WHEN o.playcount > 0
+                    THEN 100.0 * (n.playcount - o.playcount) / o.playcount
+               END AS percent
+        FROM LastfmArtistSnapshots n
+        JOIN LastfmArtistSnapshots o
+          ON o.artist_id = n.artist_id AND o.snapshot_id = ?
+        JOIN LastfmArtists a ON a.artist_id = n.artist_id
+        WHERE n.snapshot_id = ?
+        ORDER BY percent DESC
+        LIMIT ?
+    """, (elapsed_days, old[0], new[0], limit))
+    return cur.fetchall()
+
+
+def popularity_changes(cur, days=7, limit=10):
+    """
+    Spotify artists whose popularity changed the most over the last `days`.
+    Each artist is compared between its newest and oldest snapshot in the
+    window. A playlist ingest samples every artist on the playlist, but a
+    crawl only sees the artists it reached, so snapshots can differ.
+    Returns a list of (artist_name, old_popularity, new_popularity, change).
+    """
+    new = latest_snapshot(cur, SPOTIFY)
+    if new is None:
+        return []
+    window_start = new[1] - days * DAY
+
+    cur.execute("""
+        WITH recent AS (
+            SELECT s.artist_id, s.popularity, c.fetched_at
+            FROM ChartSnapshots c
+            JOIN SpotifyArtistSnapshots s ON s.snapshot_id = c.snapshot_id
+            WHERE c.source = ? AND c.fetched_at >= ?
+        ),
+        ends AS (
+            SELECT artist_id, MIN(fetched_at) AS first_at, MAX(fetched_at) AS last_at
+            FROM recent GROUP BY artist_id
+            HAVING first_at < last_at
+        )
+        SELECT a.artist_name, f.popularity, l.popularity, l.popularity - f.popularity AS change
+        FROM ends e
+        JOIN recent f ON f.artist_id = e.artist_id AND f.fetched_at = e.first_at
+        JOIN recent l ON l.artist_id = e.artist_id AND l.fetched_at = e.last_at
+        JOIN Artists a ON a.artist_id = e.artist_id
+        ORDER BY ABS(change) DESC
+        LIMIT ?
+    """, (SPOTIFY, window_start, limit))
+    return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries over stored chart snapshots.")
+    parser.add_argument("query", choices=["movers", "growth", "popularity"])
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    cur = conn.cursor()
+
+    started = time.perf_counter()
+    if args.query == "movers":
+        rows = biggest_rank_movers(cur, args.days, args.limit)
+        header = "Artist\tOld rank\tNew rank\tPlaces gained"
+    elif args.query == "growth":
+        rows = playcount_growth(cur, args.days, args.limit)
+        header = "Artist\tOld plays\tNew plays\tPlays/day\tGrowth %"
+    else:
+        rows = popularity_changes(cur, args.days, args.limit)
+        header = "Artist\tOld popularity\tNew popularity\tChange"
+    elapsed = time.perf_counter() - started
+
+    print(header)
+    for row in rows:
+        print("\t".join("{0:.2f}".format(v) if isinstance(v, float) else str(v) for v in row))
+    print("({0} rows in {1:.1f} ms)".format(len(rows), elapsed * 1000))
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Render many charts at once in a pool of worker processes.
+
+    python chart_render.py --out-dir charts --snapshots 48 --workers 4
+
+A chart spec is a dict:
+    name     file name without .png (characters other than letters,
+             digits, "-", "_" and "." become "_")
+    kind     "bar" or "line"
+    labels   x values, values: y values (same length)
+    title, xlabel, ylabel, and optionally colors
+
+Each worker draws every chart on one reused Agg figure. A hash of each
+spec is kept in a manifest file in the output directory, and charts
+whose spec has not changed since their last render are skipped.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import schema
+from buckets import (DEFAULT_BUCKET_EDGES, bucket_case_sql, bucket_labels, parse_edges,
+                     sql_bucket_stats)
+from chart_history import LASTFM
+from report_engine import GENRE_COLORS, get_genre_counts
+
+DB_NAME = "music_data.db"
+
+MANIFEST_NAME = ".chart_manifest.json"
+DEFAULT_WORKERS = os.cpu_count() or 2
+DEFAULT_SNAPSHOTS = 24
+
+# Charts handed to a worker at a time
+CHUNK_SIZE = 8
+
+# Longer x axes only label every n-th point
+MAX_TICK_LABELS = 12
+
+SAFE_NAME = re.compile(r"[^0-9A-Za-z._-]+")
+
+# The figure each worker process reuses
+_figure = None
+
+
+def chart_filename(spec, out_dir):
+    # Names that had to be changed get a short hash of the original, so
+    # "r&b" and "r b" do not both become r_b.png
+    name = SAFE_NAME.sub("_", spec["name"])
+    if name != spec["name"]:
+        name = name + "_" + hashlib.sha256(spec["name"].encode("utf-8")).hexdigest()[:8]
+    return os.path.join(out_dir, name + ".png")
+
+
+def spec_hash(spec):
+    data = json.dumps(spec, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _init_worker():
+    global _figure
+    from plotting import get_pyplot
+    _figure = get_pyplot().figure()
+
+
+def draw(figure, spec, filename):
+    figure.clear()
+    ax = figure.add_subplot()
+    labels = [str(label) for label in spec["labels"]]
+    positions = list(range(len(labels)))
+
+    if spec.get("kind", "bar") == "line":
+        ax.plot(positions, spec["values"], marker="o")
+    else:
+        colors = spec.get("colors")
+        if colors and len(labels) <= len(colors):
+            ax.bar(positions, spec["values"], color=colors[:len(labels)])
+        else:
+            ax.bar(positions, spec["values"])
+
+    step = max(1, -(-len(labels) // MAX_TICK_LABELS))
+    ax.set_xticks(positions[::step])
+    ax.set_xticklabels(labels[::step])
+
+    ax.set_title(spec.get("title", ""))
+    ax.set_xlabel(spec.get("xlabel", ""))
+    ax.set_ylabel(spec.get("ylabel", ""))
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment("right")
+    figure.tight_layout()
+    figure.savefig(filename)
+
+
+def _render(job):
+    spec, filename = job
+    draw(_figure, spec, filename)
+    return filename
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def render_charts(specs, out_dir, workers=DEFAULT_WORKERS, force=False):
+    """
+    Render every spec whose data changed since the last render.
+    Returns (rendered, skipped) lists of file names.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+
+    jobs = []
+    hashes = {}
+    skipped = []
+    for spec in specs:
+        filename = chart_filename(spec, out_dir)
+        if filename in hashes:
+            raise ValueError("two charts would be written to " + filename)
+        hashes[filename] = spec_hash(spec)
+        key = os.path.basename(filename)
+        if not force and manifest.get(key) == hashes[filename] and os.path.exists(filename):
+            skipped.append(filename)
+        else:
+            jobs.append((spec, filename))
+
+    rendered = []
+    if jobs:
+        workers = max(1, min(workers, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for filename in pool.map(_render, jobs, chunksize=CHUNK_SIZE):
+                rendered.append(filename)
+                manifest[os.path.basename(filename)] = hashes[filename]
+
+    save_manifest(out_dir, manifest)
+    return rendered, skipped
+
+
+# ---------------------------------------------------------------- specs
+
+def genre_chart_specs(cur):
+    """
+    Songs per genre, plus one popularity histogram per genre.
+    """
+    genre_counts = get_genre_counts(cur)
+    specs = [{
+        "name": "spotify_genre_counts",
+        "kind": "bar",
+        "labels": [row[0] for row in genre_counts],
+        "values": [row[1] for row in genre_counts],
+        "title": "Number of Songs per Genre in Billboard Top 100",
+        "xlabel": "Genre",
+        "ylabel": "Number of Songs",
+        "colors": GENRE_COLORS
+    }]
+
+    # Popularity in tens (0-9, 10-19, ... 100) for every genre, in one query
+    cur.execute("""
+        SELECT g.genre_name, MIN(s.popularity / 10, 9) AS band, COUNT(*)
+        FROM Songs s
+        JOIN Genres g ON g.genre_id = s.genre_id
+        WHERE s.popularity IS NOT NULL
+        GROUP BY s.genre_id, band
+        ORDER BY g.genre_name, band
+    """)
+    bands = {}
+    for genre_name, band, count in cur.fetchall():
+        bands.setdefault(genre_name, [0] * 10)[band] = count
+
+    for genre_name, counts in bands.items():
+        specs.append({
+            "name": "genre_popularity_" + genre_name,
+            "kind": "bar",
+            "labels": [str(i * 10) + "-" + str(i * 10 + 9) for i in range(10)],
+            "values": counts,
+            "title": "Popularity of " + genre_name + " songs",
+            "xlabel": "Spotify popularity",
+            "ylabel": "Number of Songs"
+        })
+    return specs
+
+
+def bucket_chart_specs(cur, edges=DEFAULT_BUCKET_EDGES, snapshots=DEFAULT_SNAPSHOTS):
+    """
+    Plays per listener by rank bucket: now, for each of the last
+    `snapshots` Last.fm snapshots, and per bucket across those snapshots.
+    """
+    labels = bucket_labels(edges)
+
+    current = sql_bucket_stats(cur, edges)
+    specs = [{
+        "name": "lastfm_bucket_plays_per_listener",
+        "kind": "bar",
+        "labels": [stat["bucket"] for stat in current],
+        "values": [stat["mean"] for stat in current],
+        "title": "Last.fm Top Artists:\nAverage Plays per Listener by Rank Bucket",
+        "xlabel": "Rank bucket",
+        "ylabel": "Average plays per listener"
+    }]
+
+    # Every recent snapshot and bucket in one GROUP BY
+    cur.execute("""
+        SELECT c.snapshot_id, c.fetched_at,
+               """ + bucket_case_sql("s.rank", edges) + """ AS bucket,
+               AVG(CAST(s.playcount AS REAL) / s.listeners)
+        FROM (SELECT snapshot_id, fetched_at FROM ChartSnapshots
+              WHERE source = ? ORDER BY fetched_at DESC LIMIT ?) c
+        JOIN LastfmArtistSnapshots s ON s.snapshot_id = c.snapshot_id
+        WHERE s.listeners > 0
+        GROUP BY c.snapshot_id, bucket
+        HAVING bucket IS NOT NULL
+        ORDER BY c.fetched_at, bucket
+    """, (LASTFM, snapshots))
+
+    by_snapshot = {}
+    by_bucket = {}
+    for snapshot_id, fetched_at, bucket, average in cur.fetchall():
+        when = time.strftime("%Y-%m-%d %H:%M", time.gmtime(fetched_at))
+        by_snapshot.setdefault((snapshot_id, when), []).append((labels[bucket], average))
+        by_bucket.setdefault(bucket, []).append((when, average))
+
+    for (snapshot_id, when), rows in by_snapshot.items():
+        specs.append({
+            "name": "lastfm_snapshot_" + str(snapshot_id),
+            "kind": "bar",
+            "labels": [row[0] for row in rows],
+            "values": [row[1] for row in rows],
+            "title": "Average Plays per Listener by Rank Bucket, " + when + " UTC",
+            "xlabel": "Rank bucket",
+            "ylabel": "Average plays per listener"
+        })
+
+    for bucket, rows in sorted(by_bucket.items()):
+        specs.append({
+            "name": "lastfm_bucket_" + labels[bucket],
+            "kind": "line",
+            "labels": [row[0] for row in rows],
+            "values": [row[1] for row in rows],
+            "title": "Ranks " + labels[bucket] + ": Average Plays per Listener",
+            "xlabel": "Snapshot (UTC)",
+            "ylabel": "Average plays per listener"
+        })
+    return specs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render genre and chart-history charts in parallel.")
+    parser.add_argument("--out-dir", default="charts")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--snapshots", type=int, default=DEFAULT_SNAPSHOTS,
+                        help="how many recent Last.fm snapshots to chart")
+    parser.add_argument("--edges", type=parse_edges, default=DEFAULT_BUCKET_EDGES)
+    parser.add_argument("--force", action="store_true", help="render even unchanged charts")
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    cur = conn.cursor()
+    specs = genre_chart_specs(cur) + bucket_chart_specs(cur, args.edges, args.snapshots)
+    conn.close()
+
+    started = time.perf_counter()
+    rendered, skipped = render_charts(specs, args.out_dir, args.workers, args.force)
+    print("Rendered {0} charts, skipped {1} unchanged, in {2:.1f}s.".format(
+        len(rendered), len(skipped), time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
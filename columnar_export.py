@@ -0,0 +1,313 @@
+"""
+Export music_data.db to typed, memory-mappable column files.
+
+    python columnar_export.py                 # append new snapshots, refresh the rest
+    python columnar_export.py --compact       # also merge snapshot chunks into one
+    python columnar_export.py --out-dir /data/columnar --db music_data.db
+
+Layout, one directory per table:
+    <out-dir>/<table>/<chunk>/<column>.npy    one NumPy array per column
+    <out-dir>/<table>/<column>.dict.json      dictionary for a string column
+    <out-dir>/<table>/meta.json               chunks, row count, last snapshot
+
+String columns are stored as int32 codes into their dictionary (-1 for
+NULL); other NULLs become -1. Artists, Genres, Songs, LastfmTopArtists
+and ArtistGenres are rewritten on every run. Snapshot tables only grow,
+so each run adds one chunk with the snapshots newer than the last
+export; --compact merges the chunks back into one. This relies on every
+snapshot being written in one transaction (chart_history.py): rows added
+to an already exported snapshot would never be picked up.
+
+Read with ColumnStore, whose arrays are np.load(..., mmap_mode="r").
+"""
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+import schema
+
+DB_NAME = "music_data.db"
+DEFAULT_OUT_DIR = "columnar"
+
+# Rows read from SQLite per np.fromiter call
+FETCH_ROWS = 500000
+
+# name -> (SELECT statement, [(column, dtype)], string columns).
+# NULLs are turned into -1 in SQL so every column has a fixed type.
+FULL_TABLES = {
+    "artists": (
+        "SELECT artist_id, artist_name FROM Artists ORDER BY artist_id",
+        [("artist_id", np.int64), ("artist_name", object)],
+        ["artist_name"]
+    ),
+    "genres": (
+        "SELECT genre_id, genre_name FROM Genres ORDER BY genre_id",
+        [("genre_id", np.int64), ("genre_name", object)],
+        ["genre_name"]
+    ),
+    "songs": (
+        "SELECT song_name, IFNULL(artist_id, -1), IFNULL(popularity, -1), "
+        "IFNULL(genre_id, -1) FROM Songs",
+        [("song_name", object), ("artist_id", np.int64), ("popularity", np.int16),
+         ("genre_id", np.int64)],
+        ["song_name"]
+    ),
+    "lastfm_top_artists": (
+        "SELECT artist_id, artist_name, IFNULL(listeners, -1), IFNULL(playcount, -1), "
+        "IFNULL(rank, -1) FROM LastfmTopArtists ORDER BY artist_id",
+        [("artist_id", np.int64), ("artist_name", object), ("listeners", np.int64),
+         ("playcount", np.int64), ("rank", np.int32)],
+        ["artist_name"]
+    ),
+    "artist_genres": (
+        "SELECT artist_id, genre_id, position FROM ArtistGenres ORDER BY artist_id, position",
+        [("artist_id", np.int64), ("genre_id", np.int64), ("position", np.int16)],
+        []
+    ),
+}
+
+# name -> (SELECT for snapshots after a given snapshot_id, [(column, dtype)])
+SNAPSHOT_TABLES = {
+    "lastfm_snapshots": (
+        "SELECT s.snapshot_id, c.fetched_at, s.artist_id, IFNULL(s.rank, -1), "
+        "IFNULL(s.listeners, -1), IFNULL(s.playcount, -1) "
+        "FROM LastfmArtistSnapshots s JOIN ChartSnapshots c ON c.snapshot_id = s.snapshot_id "
+        "WHERE s.snapshot_id > ? ORDER BY s.snapshot_id, s.artist_id",
+        [("snapshot_id", np.int64), ("fetched_at", np.int64), ("artist_id", np.int64),
+         ("rank", np.int32), ("listeners", np.int64), ("playcount", np.int64)]
+    ),
+    "spotify_snapshots": (
+        "SELECT s.snapshot_id, c.fetched_at, s.artist_id, IFNULL(s.popularity, -1) "
+        "FROM SpotifyArtistSnapshots s JOIN ChartSnapshots c ON c.snapshot_id = s.snapshot_id "
+        "WHERE s.snapshot_id > ? ORDER BY s.snapshot_id, s.artist_id",
+        [("snapshot_id", np.int64), ("fetched_at", np.int64), ("artist_id", np.int64),
+         ("popularity", np.int16)]
+    ),
+}
+
+
+def read_columns(cur, sql, columns, params=()):
+    """
+    Run sql and return {column: array}, reading FETCH_ROWS rows at a time.
+    """
+    dtype = [(name, kind) for name, kind in columns]
+    cur.execute(sql, params)
+    parts = []
+    while True:
+        rows = cur.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        parts.append(np.fromiter(rows, dtype=dtype, count=len(rows)))
+
+    if parts:
+        data = np.concatenate(parts)
+    else:
+        data = np.empty(0, dtype=dtype)
+    return dict((name, np.ascontiguousarray(data[name])) for name, _ in columns)
+
+
+def encode_strings(values):
+    """
+    Dictionary-encode an object array of strings.
+    Returns (codes as int32 with -1 for None, dictionary list).
+    """
+    codes = np.full(len(values), -1, dtype=np.int32)
+    present = np.array([value is not None for value in values], dtype=bool)
+    if present.any():
+        dictionary, inverse = np.unique(values[present].astype(str), return_inverse=True)
+        codes[present] = inverse
+        return codes, dictionary.tolist()
+    return codes, []
+
+
+def load_meta(table_dir):
+    try:
+        with open(os.path.join(table_dir, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"chunks": [], "rows": 0, "last_snapshot_id": 0}
+
+
+def save_meta(table_dir, meta):
+    path = os.path.join(table_dir, "meta.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def write_chunk(chunk_dir, arrays):
+    os.makedirs(chunk_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(chunk_dir, name + ".npy"), array)
+
+
+def export_full_table(cur, out_dir, name):
+    """
+    Rewrite one table as a single chunk. Returns the number of rows.
+    """
+    sql, columns, string_columns = FULL_TABLES[name]
+    arrays = read_columns(cur, sql, columns)
+
+    # Build next to the old copy, then swap it in
+    table_dir = os.path.join(out_dir, name)
+    staging = table_dir + ".new"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    for column in string_columns:
+        codes, dictionary = encode_strings(arrays[column])
+        arrays[column] = codes
+        with open(os.path.join(staging, column + ".dict.json"), "w") as f:
+            json.dump(dictionary, f)
+
+    rows = len(next(iter(arrays.values())))
+    write_chunk(os.path.join(staging, "000000"), arrays)
+    save_meta(staging, {"chunks": ["000000"], "rows": rows, "last_snapshot_id": 0})
+
+    old = table_dir + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(table_dir):
+        os.replace(table_dir, old)
+    os.replace(staging, table_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return rows
+
+
+def append_snapshots(cur, out_dir, name):
+    """
+    Add one chunk with the snapshots newer than the last export.
+    Returns the number of rows added.
+    """
+    sql, columns = SNAPSHOT_TABLES[name]
+    table_dir = os.path.join(out_dir, name)
+    os.makedirs(table_dir, exist_ok=True)
+    meta = load_meta(table_dir)
+
+    arrays = read_columns(cur, sql, columns, (meta["last_snapshot_id"],))
+    rows = len(arrays["snapshot_id"])
+    if rows == 0:
+        return 0
+
+    chunk = "%06d" % (int(meta["chunks"][-1]) + 1 if meta["chunks"] else 0)
+    write_chunk(os.path.join(table_dir, chunk), arrays)
+
+    meta["chunks"].append(chunk)
+    meta["rows"] = meta["rows"] + rows
+    meta["last_snapshot_id"] = int(arrays["snapshot_id"].max())
+    save_meta(table_dir, meta)
+    return rows
+
+
+def compact_table(out_dir, name):
+    """
+    Merge all chunks of a snapshot table into one.
+    """
+    table_dir = os.path.join(out_dir, name)
+    meta = load_meta(table_dir)
+    if len(meta["chunks"]) <= 1:
+        return
+
+    store = ColumnStore(out_dir)
+    chunks = list(store.chunks(name))
+    merged = {}
+    for column in chunks[0]:
+        merged[column] = np.concatenate([chunk[column] for chunk in chunks])
+    del chunks
+
+    chunk = "%06d" % (int(meta["chunks"][-1]) + 1)
+    write_chunk(os.path.join(table_dir, chunk), merged)
+    old_chunks = meta["chunks"]
+    meta["chunks"] = [chunk]
+    save_meta(table_dir, meta)
+    for old in old_chunks:
+        shutil.rmtree(os.path.join(table_dir, old), ignore_errors=True)
+
+
+def export(conn, out_dir=DEFAULT_OUT_DIR, compact=False):
+    """
+    Refresh the full tables and append new snapshots.
+    Returns {table: rows written}.
+    """
+    cur = conn.cursor()
+    os.makedirs(out_dir, exist_ok=True)
+
+    # One read transaction, so every table comes from the same moment
+    cur.execute("BEGIN")
+    try:
+        written = {}
+        for name in FULL_TABLES:
+            written[name] = export_full_table(cur, out_dir, name)
+        for name in SNAPSHOT_TABLES:
+            written[name] = append_snapshots(cur, out_dir, name)
+    finally:
+        conn.rollback()
+
+    if compact:
+        for name in SNAPSHOT_TABLES:
+            compact_table(out_dir, name)
+    return written
+
+
+class ColumnStore:
+    """
+    Read access to an export. Arrays are memory-mapped, so nothing is
+    loaded until it is used.
+    """
+
+    def __init__(self, path=DEFAULT_OUT_DIR):
+        self.path = path
+
+    def meta(self, name):
+        return load_meta(os.path.join(self.path, name))
+
+    def chunks(self, name, columns=None):
+        """
+        Yield {column: memory-mapped array} for each chunk of a table.
+        """
+        table_dir = os.path.join(self.path, name)
+        for chunk in self.meta(name)["chunks"]:
+            chunk_dir = os.path.join(table_dir, chunk)
+            arrays = {}
+            for filename in sorted(os.listdir(chunk_dir)):
+                column = filename[:-len(".npy")]
+                if columns is None or column in columns:
+                    arrays[column] = np.load(os.path.join(chunk_dir, filename), mmap_mode="r")
+            yield arrays
+
+    def table(self, name, columns=None):
+        """
+        {column: array} for a single-chunk table (all of the full tables,
+        and snapshot tables after --compact).
+        """
+        chunks = list(self.chunks(name, columns))
+        if len(chunks) != 1:
+            raise ValueError(name + " has " + str(len(chunks)) + " chunks; iterate chunks() "
+                             "or compact it first")
+        return chunks[0]
+
+    def dictionary(self, name, column):
+        with open(os.path.join(self.path, name, column + ".dict.json")) as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export music_data.db to columnar .npy files.")
+    parser.add_argument("--out-dir", default=DEFAULT_OUT_DIR)
+    parser.add_argument("--compact", action="store_true", help="merge snapshot chunks afterwards")
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    written = export(conn, args.out_dir, args.compact)
+    conn.close()
+
+    for name, rows in written.items():
+        print(name + ": " + str(rows) + " rows")
+
+
+if __name__ == "__main__":
+    main()
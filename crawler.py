@@ -0,0 +1,361 @@
+"""
+Crawl many playlists and artists at once into music_data.db.
+
+    python crawler.py --playlist "old songs(2000-2017)" --playlist 37i9dQZF1DXcBWIGoYBM5M \\
+        --artist 06HL4z0CvFAxyc27GXpf02 --follow-artists --rate 8
+
+Every Spotify request, from every source, goes through one token-bucket
+rate limiter. Tracks are deduplicated across sources and all writes go
+through a single writer, so SQLite only ever sees one writing connection.
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import Spotify_Data as spotify
+import schema
+from store_spotify import load_id_maps, store_songs
+from chart_history import record_spotify_snapshot
+
+DB_NAME = "music_data.db"
+
+# Spotify IDs are 22 base-62 characters
+SPOTIFY_ID = re.compile(r"^[0-9A-Za-z]{22}$")
+
+# Spotify allows roughly this many requests per second per app
+DEFAULT_RATE = 8.0
+DEFAULT_BURST = 8
+DEFAULT_CONCURRENCY = 8
+
+# Rows handed to the writer per transaction
+WRITE_BATCH_SIZE = 200
+
+
+class TokenBucket:
+    """
+    Async token bucket: on average `rate` acquisitions per second, with
+    bursts of up to `burst`. Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def parse_spotify_id(value, kind):
+    """
+    Accept a bare ID, a spotify:<kind>:<id> URI or an open.spotify.com URL.
+    Returns the ID, or None if value looks like a name to search for.
+    """
+    match = re.search(kind + r"[/:]([0-9A-Za-z]{22})", value)
+    if match:
+        return match.group(1)
+    if SPOTIFY_ID.match(value):
+        return value
+    return None
+
+
+class Crawler:
+    def __init__(self, token, db_name, rate, burst, concurrency, follow_artists, max_artists):
+        self.token = token
+        self.db_name = db_name
+        self.limiter = TokenBucket(rate, burst)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.follow_artists = follow_artists
+        self.max_artists = max_artists
+
+        self.seen_tracks = set()
+        self.artist_info = {}
+        self.crawled_artists = set()
+        self.tasks = []
+
+        self.queue = asyncio.Queue(maxsize=concurrency * 4)
+        self.requests = 0
+        self.stored = 0
+
+        # The SQLite connection lives on this one thread for the whole crawl
+        self.db_thread = ThreadPoolExecutor(max_workers=1)
+        self.conn = None
+        # {Artists.artist_id: popularity} for the whole crawl
+        self.popularity = {}
+
+    # ---------------------------------------------------------------- HTTP
+
+    async def call(self, fn, *args):
+        # Run one blocking API call in a worker thread, under the global
+        # rate limit and the concurrency cap
+        async with self.slots:
+            await self.limiter.acquire()
+            self.requests = self.requests + 1
+            return await asyncio.to_thread(fn, *args)
+
+    async def get_json(self, url):
+        result = await self.call(spotify.spotify_get, self.token, url)
+        return json.loads(result.content)
+
+    # ------------------------------------------------------------- sources
+
+    async def resolve_ids(self, values, kind):
+        # IDs, URIs and URLs are used as they are. Names are resolved in one
+        # go through the name cache, which only searches for names it has
+        # not seen. Its searches run on the cache's threads but are handed
+        # back to this loop, so they count against the same rate limit.
+        ids = {}
+        names = []
+        for value in values:
+            spotify_id = parse_spotify_id(value, kind)
+            if spotify_id is None:
+                names.append(value)
+            else:
+                ids[value] = spotify_id
+
+        if names:
+            loop = asyncio.get_running_loop()
+
+            def limited(fn, *args):
+                return asyncio.run_coroutine_threadsafe(self.call(fn, *args), loop).result()
+
+            ids.update(await asyncio.to_thread(spotify.resolve_names, self.token, kind, names,
+                                               spotify.ARTIST_WORKERS, limited))
+
+        found = []
+        for value in values:
+            if ids[value] is None:
+                print(f"No {kind} found for {value!r}, skipping.")
+            else:
+                found.append(ids[value])
+        return found
+
+    async def crawl_playlist(self, playlist_id):
+        params = {"limit": spotify.PLAYLIST_PAGE_SIZE, "fields": spotify.PLAYLIST_TRACK_FIELDS}
+        url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?" + urlencode(params)
+        while url is not None:
+            page = await self.get_json(url)
+            tracks = [item["track"] for item in page.get("items", []) if item.get("track")]
+            await self.add_tracks(tracks, discovered=True)
+            url = page.get("next")
+
+    async def crawl_artist(self, artist_id):
+        if artist_id in self.crawled_artists:
+            return
+        self.crawled_artists.add(artist_id)
+        await self.crawl_top_tracks(artist_id)
+
+    async def crawl_top_tracks(self, artist_id):
+        page = await self.get_json(
+            f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks?country=US")
+        await self.add_tracks(page.get("tracks", []), discovered=False)
+
+    # ------------------------------------------------------------- tracks
+
+    async def resolve_artists(self, tracks):
+        # Fetch details only for artists no earlier page has resolved
+        missing = []
+        for track in tracks:
+            artist_id = track["artists"][0]["id"]
+            if artist_id is not None and artist_id not in self.artist_info and artist_id not in missing:
+                missing.append(artist_id)
+
+        chunks = []
+        for start in range(0, len(missing), spotify.ARTIST_BATCH_SIZE):
+            chunks.append(missing[start:start + spotify.ARTIST_BATCH_SIZE])
+
+        results = await asyncio.gather(*[
+            self.call(spotify.get_several_artists, self.token, chunk) for chunk in chunks])
+        for batch in results:
+            for info in batch:
+                if info is not None:
+                    self.artist_info[info["id"]] = info
+
+    async def add_tracks(self, tracks, discovered):
+        new_tracks = []
+        for track in tracks:
+            track_id = track.get("id")
+            if track_id is None or track_id in self.seen_tracks or not track.get("artists"):
+                continue
+            self.seen_tracks.add(track_id)
+            new_tracks.append(track)
+
+        if not new_tracks:
+            return
+
+        await self.resolve_artists(new_tracks)
+        rows = [spotify.build_song_row(track, self.artist_info) for track in new_tracks]
+        await self.queue.put(rows)
+
+        if discovered and self.follow_artists:
+            for track in new_tracks:
+                artist_id = track["artists"][0]["id"]
+                if artist_id is None or artist_id in self.crawled_artists:
+                    continue
+                if len(self.crawled_artists) >= self.max_artists:
+                    break
+                self.crawled_artists.add(artist_id)
+                self.tasks.append(asyncio.create_task(self.crawl_top_tracks(artist_id)))
+
+    # ------------------------------------------------------------- writer
+
+    def _open_db(self):
+        self.conn = schema.connect(self.db_name)
+        self.cur = self.conn.cursor()
+        self.artist_map, self.genre_map = load_id_maps(self.cur)
+
+    def _write(self, rows):
+        inserted = store_songs(self.conn, self.cur, rows, self.artist_map, self.genre_map)
+
+        # The whole crawl is one popularity snapshot, recorded at the end.
+        # rows has every track this crawl found, stored before or not, so
+        # each crawled artist is sampled.
+        for row in rows:
+            self.popularity[self.artist_map[row["artist_name"]]] = row["popularity"]
+        return inserted
+
+    def _record_snapshot(self):
+        # Written in one go, so readers (columnar_export.py) never see a
+        # snapshot that is still growing
+        record_spotify_snapshot(self.conn, self.cur, self.popularity)
+
+    def _close_db(self):
+        self.conn.close()
+
+    async def writer(self):
+        loop = asyncio.get_running_loop()
+        pending = []
+        while True:
+            rows = await self.queue.get()
+            if rows is None:
+                break
+            pending.extend(rows)
+            if len(pending) >= WRITE_BATCH_SIZE:
+                self.stored += await loop.run_in_executor(self.db_thread, self._write, pending)
+                pending = []
+        if pending:
+            self.stored += await loop.run_in_executor(self.db_thread, self._write, pending)
+        await loop.run_in_executor(self.db_thread, self._record_snapshot)
+
+    # --------------------------------------------------------------- run
+
+    async def crawl(self, playlists, artists):
+        playlist_ids = await self.resolve_ids(playlists, "playlist")
+        artist_ids = await self.resolve_ids(artists, "artist")
+        sources = [asyncio.create_task(self.crawl_playlist(playlist_id))
+                   for playlist_id in playlist_ids]
+        sources += [asyncio.create_task(self.crawl_artist(artist_id)) for artist_id in artist_ids]
+        self.tasks.extend(sources)
+
+        # Followed artists can be scheduled while others finish
+        while self.tasks:
+            tasks = self.tasks
+            self.tasks = []
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                self.tasks.extend(tasks)
+                raise
+
+    async def stop(self, crawl):
+        # Cancel the crawl and every source it started
+        crawl.cancel()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(crawl, *self.tasks, return_exceptions=True)
+
+    async def run(self, playlists, artists):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.db_thread, self._open_db)
+        writer = asyncio.create_task(self.writer())
+        crawl = asyncio.create_task(self.crawl(playlists, artists))
+
+        try:
+            # The queue is bounded, so if the writer dies the sources would
+            # wait on put() forever. The writer only finishes early by
+            # failing; then the crawl is cancelled and its error raised.
+            await asyncio.wait([crawl, writer], return_when=asyncio.FIRST_COMPLETED)
+            if writer.done():
+                await self.stop(crawl)
+                writer.result()
+            crawl.result()
+
+            # The last flush and the snapshot happen after the sentinel, so
+            # wait for them here and let their errors through
+            await self.queue.put(None)
+            await writer
+        finally:
+            await self.stop(crawl)
+            if not writer.done():
+                # The crawl failed or was cancelled: store what was found,
+                # but its error is the one raised
+                await self.queue.put(None)
+                await asyncio.gather(writer, return_exceptions=True)
+            await loop.run_in_executor(self.db_thread, self._close_db)
+            self.db_thread.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl Spotify playlists and artists into music_data.db.")
+    parser.add_argument("--playlist", action="append", default=[],
+                        help="playlist name, ID, URI or URL (repeatable)")
+    parser.add_argument("--artist", action="append", default=[],
+                        help="artist name, ID, URI or URL whose top tracks to crawl (repeatable)")
+    parser.add_argument("--sources-file", help="file with one 'playlist <value>' or 'artist <value>' per line")
+    parser.add_argument("--follow-artists", action="store_true",
+                        help="also crawl the top tracks of every artist found in the playlists")
+    parser.add_argument("--max-artists", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="requests per second, across all sources")
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    playlists = list(args.playlist)
+    artists = list(args.artist)
+
+    if args.sources_file:
+        with open(args.sources_file) as f:
+            for line in f:
+                kind, _, value = line.strip().partition(" ")
+                if kind == "playlist":
+                    playlists.append(value.strip())
+                elif kind == "artist":
+                    artists.append(value.strip())
+
+    if not playlists and not artists:
+        parser.error("give at least one --playlist or --artist")
+
+    crawler = Crawler(spotify.get_token(), args.db, args.rate, args.burst,
+                      args.concurrency, args.follow_artists, args.max_artists)
+
+    started = time.time()
+    asyncio.run(crawler.run(playlists, artists))
+    elapsed = time.time() - started
+
+    print(f"Crawled {len(playlists)} playlists and {len(crawler.crawled_artists)} artists "
+          f"in {elapsed:.1f}s: {crawler.requests} requests, "
+          f"{len(crawler.seen_tracks)} unique tracks, {crawler.stored} new songs stored.")
+    spotify.response_cache.print_stats()
+    spotify.response_cache.close()
+    spotify.name_cache.print_stats()
+    spotify.name_cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# Query parameters that carry credentials; they are never written to disk
+# and never take part in matching a request to a fixture.
+SECRET_PARAMS = {"api_key"}
+
+# Hosts whose responses are not recorded (token responses hold secrets)
+SKIP_HOSTS = {"accounts.spotify.com"}
+
+# Response headers worth keeping in a fixture
+KEPT_HEADERS = ["Content-Type", "ETag", "Retry-After"]
+
+
+def clean_query(query, drop=()):
+    """
+    Return the query string without secret parameters (and any names in
+    drop), with parameters sorted so equivalent URLs compare equal.
+    """
+    pairs = []
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name in SECRET_PARAMS or name in drop:
+            continue
+        pairs.append((name, value))
+    pairs.sort()
+    return urlencode(pairs)
+
+
+def fixture_key(method, url, drop=()):
+    """
+    Key that identifies a request regardless of credentials or the order
+    of its query parameters, e.g. "GET api.spotify.com/v1/search?q=..".
+    """
+    parts = urlsplit(url)
+    key = method.upper() + " " + parts.netloc + parts.path
+    query = clean_query(parts.query, drop)
+    if query:
+        key = key + "?" + query
+    return key
+
+
+def fixture_filename(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".json"
+
+
+def save_fixture(directory, method, url, response):
+    """
+    Write one response to directory as a JSON fixture.
+    """
+    parts = urlsplit(url)
+    if parts.netloc in SKIP_HOSTS:
+        return
+
+    headers = {}
+    for name in KEPT_HEADERS:
+        if name in response.headers:
+            headers[name] = response.headers[name]
+
+    key = fixture_key(method, url)
+    fixture = {
+        "key": key,
+        "method": method.upper(),
+        "host": parts.netloc,
+        "path": parts.path,
+        "query": clean_query(parts.query),
+        "status": response.status_code,
+        "headers": headers,
+        "body": response.content.decode("utf-8", errors="replace")
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, fixture_filename(key)), "w") as f:
+        json.dump(fixture, f, indent=1)
+
+
+def load_fixtures(directory):
+    """
+    Read every fixture in directory. Returns {key: fixture}.
+    """
+    fixtures = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            fixture = json.load(f)
+        fixtures[fixture["key"]] = fixture
+    return fixtures
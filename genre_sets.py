@@ -0,0 +1,222 @@
+"""
+Multi-genre questions over ArtistGenres, answered with per-artist bitsets.
+
+    python genre_sets.py --all pop,edm          # songs whose artist has both
+    python genre_sets.py --any "k-pop,j-pop"    # songs whose artist has either
+    python genre_sets.py --pairs 10             # genre pairs sharing the most songs
+    python genre_sets.py --with pop --top 10    # genres seen most often with pop
+
+Every artist with at least one genre is one row of bits, one bit per
+genre, packed eight to a byte (np.packbits). "pop AND edm" is then a
+bitwise AND of every row with a mask, instead of a self-join of
+ArtistGenres per genre. Song counts come from weighting each artist by
+its number of songs.
+"""
+
+import argparse
+
+import numpy as np
+
+import schema
+
+DB_NAME = "music_data.db"
+
+
+class GenreSets:
+    """
+    Packed genre bitsets for every artist that has a genre.
+
+    artist_ids  sorted artist IDs, one per row
+    genres      genre names, one per bit
+    bits        uint8 array (artists, ceil(genres / 8)), bit i of a row is
+                genres[i], little-endian within each byte
+    songs       number of Songs rows per artist
+    """
+
+    def __init__(self, artist_ids, genres, bits, songs):
+        self.artist_ids = artist_ids
+        self.genres = genres
+        self.bits = bits
+        self.songs = songs
+        self.positions = dict((name, i) for i, name in enumerate(genres))
+
+    @classmethod
+    def load(cls, cur):
+        cur.execute("""
+            SELECT g.genre_name, COUNT(*)
+            FROM ArtistGenres ag
+            JOIN Genres g ON g.genre_id = ag.genre_id
+            GROUP BY ag.genre_id
+            ORDER BY COUNT(*) DESC, g.genre_name
+        """)
+        genres = [row[0] for row in cur.fetchall()]
+        positions = dict((name, i) for i, name in enumerate(genres))
+
+        cur.execute("""
+            SELECT ag.artist_id, g.genre_name
+            FROM ArtistGenres ag
+            JOIN Genres g ON g.genre_id = ag.genre_id
+        """)
+        pairs = cur.fetchall()
+        pair_artists = np.fromiter((row[0] for row in pairs), dtype=np.int64, count=len(pairs))
+        pair_genres = np.fromiter((positions[row[1]] for row in pairs), dtype=np.int64,
+                                  count=len(pairs))
+
+        # Set the bits straight into the packed rows; a dense bool matrix
+        # of artists x genres would be eight times the size
+        artist_ids, rows = np.unique(pair_artists, return_inverse=True)
+        bits = np.zeros((len(artist_ids), (len(genres) + 7) // 8), dtype=np.uint8)
+        np.bitwise_or.at(bits, (rows, pair_genres >> 3),
+                         np.left_shift(1, pair_genres & 7).astype(np.uint8))
+
+        cur.execute("""
+            SELECT artist_id, COUNT(*) FROM Songs
+            WHERE artist_id IN (SELECT artist_id FROM ArtistGenres)
+            GROUP BY artist_id
+        """)
+        counts = cur.fetchall()
+        songs = np.zeros(len(artist_ids), dtype=np.int64)
+        if counts:
+            counted = np.array(counts, dtype=np.int64)
+            songs[np.searchsorted(artist_ids, counted[:, 0])] = counted[:, 1]
+
+        return cls(artist_ids, genres, bits, songs)
+
+    def mask(self, genres):
+        """
+        One row of bits with every genre in genres set.
+        Raises ValueError for a genre no artist has.
+        """
+        member = np.zeros(len(self.genres), dtype=bool)
+        for name in genres:
+            if name not in self.positions:
+                raise ValueError("no artist has the genre " + repr(name))
+            member[self.positions[name]] = True
+        return np.packbits(member, bitorder="little")
+
+    def has_all(self, genres):
+        """
+        Boolean array: which artists have every genre in genres.
+        """
+        mask = self.mask(genres)
+        return ((self.bits & mask) == mask).all(axis=1)
+
+    def has_any(self, genres):
+        """
+        Boolean array: which artists have at least one genre in genres.
+        """
+        return (self.bits & self.mask(genres)).any(axis=1)
+
+    def count(self, artists):
+        """
+        (songs, artists) for a boolean artist selection.
+        """
+        return int(self.songs[artists].sum()), int(np.count_nonzero(artists))
+
+    def pairs(self, artists=None):
+        """
+        (rows, genres) index arrays, one entry per set bit of the selected
+        rows, sorted by row. Only non-zero bytes are unpacked, so memory
+        follows the number of artist-genre pairs, not artists x genres.
+        """
+        bits = self.bits if artists is None else self.bits[artists]
+        rows, columns = np.nonzero(bits)
+        unpacked = np.unpackbits(bits[rows, columns][:, None], axis=1, bitorder="little")
+        entries, offsets = np.nonzero(unpacked)
+        return rows[entries], columns[entries] * 8 + offsets
+
+    def genre_pairs(self):
+        """
+        (first, second, songs) arrays with one entry per genre pair of each
+        artist, including each genre paired with itself; an artist with k
+        genres adds k * k entries.
+        """
+        rows, genres = self.pairs()
+        # Pair every entry with each entry of the same row
+        per_row = np.bincount(rows, minlength=len(self.artist_ids))
+        repeats = per_row[rows]
+        first = np.repeat(np.arange(len(rows)), repeats)
+        row_starts = np.cumsum(per_row) - per_row
+        offsets = np.arange(len(first)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        second = row_starts[rows[first]] + offsets
+        return genres[first], genres[second], self.songs[rows[first]]
+
+    def co_occurrence(self):
+        """
+        Matrix [i, j] = songs whose artist has both genres[i] and
+        genres[j]; the diagonal is songs per genre.
+        """
+        first, second, songs = self.genre_pairs()
+        matrix = np.zeros((len(self.genres), len(self.genres)), dtype=np.int64)
+        np.add.at(matrix, (first, second), songs)
+        return matrix
+
+    def top_pairs(self, limit=10):
+        """
+        [(genre, genre, songs)] for the pairs that share the most songs.
+        Only pairs some artist has are counted, without a genres x genres
+        matrix.
+        """
+        first, second, songs = self.genre_pairs()
+        keep = first < second
+        keys = first[keep] * len(self.genres) + second[keep]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=songs[keep], minlength=len(keys)).astype(np.int64)
+        # Ties keep the row-major order of the full matrix
+        order = np.argsort(-counts, kind="stable")[:limit]
+        return [(self.genres[keys[i] // len(self.genres)], self.genres[keys[i] % len(self.genres)],
+                 int(counts[i])) for i in order if counts[i] > 0]
+
+    def top_with(self, genre, limit=10):
+        """
+        [(genre, songs)] for the genres most often found alongside genre.
+        """
+        artists = self.has_all([genre])
+        rows, genres = self.pairs(artists)
+        counts = np.bincount(genres, weights=self.songs[artists][rows],
+                             minlength=len(self.genres)).astype(np.int64)
+        counts[self.positions[genre]] = 0
+        order = np.argsort(-counts, kind="stable")[:limit]
+        return [(self.genres[i], int(counts[i])) for i in order if counts[i] > 0]
+
+
+def parse_genres(text):
+    return [name.strip() for name in text.split(",") if name.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-genre counts from ArtistGenres.")
+    parser.add_argument("--all", type=parse_genres, help="comma-separated genres, all required")
+    parser.add_argument("--any", type=parse_genres, help="comma-separated genres, any one")
+    parser.add_argument("--pairs", type=int, default=0, metavar="N",
+                        help="print the N genre pairs that share the most songs")
+    parser.add_argument("--with", dest="with_genre", help="genres most often seen with this one")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    sets = GenreSets.load(conn.cursor())
+    conn.close()
+    print("{0} artists, {1} genres.".format(len(sets.artist_ids), len(sets.genres)))
+
+    try:
+        if args.all:
+            songs, artists = sets.count(sets.has_all(args.all))
+            print(" AND ".join(args.all) + ": " + str(songs) + " songs by " + str(artists) + " artists")
+        if args.any:
+            songs, artists = sets.count(sets.has_any(args.any))
+            print(" OR ".join(args.any) + ": " + str(songs) + " songs by " + str(artists) + " artists")
+        if args.with_genre:
+            for name, songs in sets.top_with(args.with_genre, args.top):
+                print(args.with_genre + " + " + name + "\t" + str(songs))
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.pairs:
+        for first, second, songs in sets.top_pairs(args.pairs):
+            print(first + " + " + second + "\t" + str(songs))
+
+
+if __name__ == "__main__":
+    main()
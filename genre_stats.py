@@ -0,0 +1,88 @@
+"""
+Check or rebuild the GenreStats table against a full recount of Songs.
+
+    python genre_stats.py check      # exit status 1 if anything differs
+    python genre_stats.py rebuild
+"""
+
+import argparse
+import sys
+
+import schema
+
+DB_NAME = "music_data.db"
+
+
+def recount_genres(cur):
+    """
+    Count songs per genre the slow way. Returns {genre_id: song_count},
+    with songs that have no genre under 0.
+    """
+    cur.execute("SELECT IFNULL(genre_id, 0), COUNT(*) FROM Songs GROUP BY IFNULL(genre_id, 0)")
+    return dict(cur.fetchall())
+
+
+def load_genre_stats(cur):
+    cur.execute("SELECT genre_id, song_count FROM GenreStats WHERE song_count != 0")
+    return dict(cur.fetchall())
+
+
+def check_genre_stats(cur):
+    """
+    Compare GenreStats with a full recount.
+    Returns a list of (genre_id, stored_count, actual_count) that differ.
+    """
+    stored = load_genre_stats(cur)
+    actual = recount_genres(cur)
+
+    mismatches = []
+    for genre_id in sorted(set(stored) | set(actual)):
+        if stored.get(genre_id, 0) != actual.get(genre_id, 0):
+            mismatches.append((genre_id, stored.get(genre_id, 0), actual.get(genre_id, 0)))
+    return mismatches
+
+
+def rebuild_genre_stats(conn, cur):
+    """
+    Replace GenreStats with a full recount, in one transaction.
+    """
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute("DELETE FROM GenreStats")
+        cur.execute("""
+            INSERT INTO GenreStats (genre_id, song_count)
+            SELECT IFNULL(genre_id, 0), COUNT(*) FROM Songs GROUP BY IFNULL(genre_id, 0)
+        """)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or rebuild GenreStats.")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    conn = schema.connect(args.db)
+    cur = conn.cursor()
+
+    if args.command == "rebuild":
+        rebuild_genre_stats(conn, cur)
+
+    mismatches = check_genre_stats(cur)
+    conn.close()
+
+    if not mismatches:
+        print("GenreStats matches Songs.")
+        return
+
+    print("genre_id\tstored\tactual")
+    for genre_id, stored, actual in mismatches:
+        print(str(genre_id) + "\t" + str(stored) + "\t" + str(actual))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import email.utils
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+from fixtures import save_fixture
+
+# Timeouts in seconds: (connect, read)
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+# Retries after the first attempt, for 429/5xx and connection errors
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Longest Retry-After we wait out. A server asking for more gets its
+# response handed back instead of stalling the calling thread.
+RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", "60"))
+
+# Keep-alive connections kept open per host
+POOL_SIZE = 16
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Offline runs. With HTTP_RECORD_DIR set, every response is also written
+# there as a fixture. With HTTP_REPLAY_URL set (e.g. http://127.0.0.1:8765),
+# every request is sent to stub_server.py instead of the real host.
+RECORD_DIR = os.getenv("HTTP_RECORD_DIR")
+REPLAY_URL = os.getenv("HTTP_REPLAY_URL")
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """
+    Return the shared Session for the host in url, creating it on first use.
+    Reusing one Session per host keeps connections (and TLS) alive between
+    calls instead of reconnecting every time.
+    """
+    host = urlsplit(url).netloc
+
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+
+    return session
+
+
+def parse_retry_after(value):
+    """
+    Turn a Retry-After header (seconds or an HTTP date) into seconds.
+    Returns None if the header is missing or unreadable.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def retry_delay(attempt, response=None):
+    """
+    How long to sleep before retry number attempt + 1.
+    The server's Retry-After wins; otherwise exponential backoff with
+    full jitter so parallel workers do not retry in lockstep.
+    Returns None if Retry-After is longer than RETRY_AFTER_MAX, meaning
+    the request should not be retried.
+    """
+    if response is not None:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            if retry_after > RETRY_AFTER_MAX:
+                return None
+            return retry_after
+
+    ceiling = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def replay_url(url):
+    """
+    Point url at the replay stub, keeping the original host in the path:
+    https://api.spotify.com/v1/search?q=x -> {REPLAY_URL}/api.spotify.com/v1/search?q=x
+    """
+    parts = urlsplit(url)
+    target = REPLAY_URL.rstrip("/") + "/" + parts.netloc + parts.path
+    if parts.query:
+        target = target + "?" + parts.query
+    return target
+
+
+def request(method, url, timeout=None, max_retries=None, **kwargs):
+    """
+    Send a request through the pooled Session for the url's host.
+
+    Responses with a status in RETRY_STATUSES, timeouts and connection
+    errors are retried up to max_retries times, unless Retry-After asks
+    for more than RETRY_AFTER_MAX seconds. The last response is
+    returned as-is (even a 429 or 5xx), so callers handle status codes
+    the same way they would with requests.
+    """
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+
+    # Fold params into the URL so recording and replay see the full request
+    if kwargs.get("params"):
+        url = requests.Request(method, url, params=kwargs.pop("params")).prepare().url
+
+    original_url = url
+    if REPLAY_URL:
+        url = replay_url(url)
+
+    session = get_session(url)
+
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if instrumentation.ENABLED:
+                instrumentation.record_http(method, original_url, "error",
+                                            time.perf_counter() - started, 0)
+            if attempt >= max_retries:
+                raise
+            time.sleep(retry_delay(attempt))
+            attempt = attempt + 1
+            continue
+
+        if instrumentation.ENABLED:
+            instrumentation.record_http(method, original_url, response.status_code,
+                                        time.perf_counter() - started, len(response.content))
+
+        delay = None
+        if response.status_code in RETRY_STATUSES and attempt < max_retries:
+            delay = retry_delay(attempt, response)
+        if delay is None:
+            if RECORD_DIR:
+                save_fixture(RECORD_DIR, method, original_url, response)
+            return response
+
+        time.sleep(delay)
+        attempt = attempt + 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -0,0 +1,273 @@
+"""
+Opt-in timing for HTTP calls and SQLite statements.
+
+    INSTRUMENT=json python Spotify_Data.py
+    INSTRUMENT=prometheus INSTRUMENT_OUTPUT=metrics.prom python store_lastfm.py
+
+With INSTRUMENT unset nothing is recorded: http_client checks one module
+flag per request and schema.connect returns a plain sqlite3 connection.
+
+When enabled it records:
+  HTTP, per endpoint (host + path with IDs folded to {id}): a latency
+  histogram per attempt, status codes and response bytes.
+  SQLite, per statement text: calls and wall time of execute/executemany,
+  executions seen by set_trace_callback (one per executemany row, plus
+  one per statement run by a trigger), and virtual machine steps counted
+  by the progress handler.
+A summary is written at exit to INSTRUMENT_OUTPUT (default: stderr).
+"""
+
+import atexit
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+FORMATS = ("json", "prometheus")
+
+# Upper bounds (seconds) of the HTTP latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# The progress handler runs every this many SQLite VM instructions
+PROGRESS_STEPS = 1000
+
+# Statement texts are cut to this length in the summary
+MAX_STATEMENT_LENGTH = 200
+
+ENABLED = False
+FORMAT = None
+OUTPUT = None
+
+# Path segments that are IDs rather than part of the endpoint
+ID_SEGMENT = re.compile(r"^([0-9A-Za-z]{22}|\d+)$")
+
+_lock = threading.Lock()
+_http = {}
+_sql = {}
+_local = threading.local()
+
+
+def enable(format="json", output=None):
+    """
+    Start recording and write a summary at exit. Connections opened
+    before this call are not instrumented.
+    """
+    global ENABLED, FORMAT, OUTPUT
+    if format not in FORMATS:
+        raise ValueError("INSTRUMENT must be one of " + ", ".join(FORMATS))
+    if not ENABLED:
+        atexit.register(write_summary)
+    ENABLED = True
+    FORMAT = format
+    OUTPUT = output
+
+
+def endpoint_name(url):
+    parts = urlsplit(url)
+    segments = []
+    for segment in parts.path.split("/"):
+        if ID_SEGMENT.match(segment):
+            segment = "{id}"
+        segments.append(segment)
+    return parts.netloc + "/".join(segments)
+
+
+def statement_name(sql):
+    sql = " ".join(sql.split())
+    if len(sql) > MAX_STATEMENT_LENGTH:
+        sql = sql[:MAX_STATEMENT_LENGTH] + "..."
+    return sql
+
+
+# ---------------------------------------------------------------- HTTP
+
+def record_http(method, url, status, seconds, size):
+    """
+    Record one HTTP attempt. status is the status code, or "error" for a
+    connection error or timeout.
+    """
+    key = method + " " + endpoint_name(url)
+    with _lock:
+        stats = _http.get(key)
+        if stats is None:
+            stats = {"count": 0, "seconds": 0.0, "bytes": 0,
+                     "buckets": [0] * (len(LATENCY_BUCKETS) + 1), "statuses": {}}
+            _http[key] = stats
+
+        stats["count"] = stats["count"] + 1
+        stats["seconds"] = stats["seconds"] + seconds
+        stats["bytes"] = stats["bytes"] + size
+
+        index = len(LATENCY_BUCKETS)
+        for i in range(len(LATENCY_BUCKETS)):
+            if seconds <= LATENCY_BUCKETS[i]:
+                index = i
+                break
+        stats["buckets"][index] = stats["buckets"][index] + 1
+
+        status = str(status)
+        stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+
+
+# -------------------------------------------------------------- SQLite
+
+def _sql_stats(key):
+    stats = _sql.get(key)
+    if stats is None:
+        stats = {"calls": 0, "seconds": 0.0, "traced": 0, "vm_steps": 0}
+        _sql[key] = stats
+    return stats
+
+
+def record_sql(key, seconds):
+    with _lock:
+        stats = _sql_stats(key)
+        stats["calls"] = stats["calls"] + 1
+        stats["seconds"] = stats["seconds"] + seconds
+
+
+def _trace(sql):
+    # Called each time SQLite starts a statement: once per row of an
+    # executemany, and again for every statement a trigger runs. The text
+    # has the parameters substituted, so it is counted against the
+    # statement the cursor is running instead.
+    key = getattr(_local, "statement", None) or statement_name(sql)
+    with _lock:
+        stats = _sql_stats(key)
+        stats["traced"] = stats["traced"] + 1
+
+
+def _progress():
+    # Charged to the statement the cursor on this thread is running
+    key = getattr(_local, "statement", None)
+    if key is not None:
+        with _lock:
+            stats = _sql_stats(key)
+            stats["vm_steps"] = stats["vm_steps"] + PROGRESS_STEPS
+    return 0
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        key = statement_name(sql)
+        _local.statement = key
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_sql(key, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        key = statement_name(sql)
+        _local.statement = key
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_sql(key, time.perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(db_name, **kwargs):
+    """
+    sqlite3.connect, with statement timing, tracing and VM step counts.
+    """
+    conn = sqlite3.connect(db_name, factory=TimedConnection, **kwargs)
+    conn.set_trace_callback(_trace)
+    conn.set_progress_handler(_progress, PROGRESS_STEPS)
+    return conn
+
+
+# ------------------------------------------------------------- summary
+
+def summary():
+    with _lock:
+        http = json.loads(json.dumps(_http))
+        sql = json.loads(json.dumps(_sql))
+
+    for stats in http.values():
+        stats["latency_buckets"] = dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"],
+                                            stats.pop("buckets")))
+    return {"http": http, "sql": sql}
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_text():
+    with _lock:
+        http = json.loads(json.dumps(_http))
+        sql = json.loads(json.dumps(_sql))
+
+    lines = ["# TYPE http_request_duration_seconds histogram"]
+    for key in sorted(http):
+        stats = http[key]
+        method, _, endpoint = key.partition(" ")
+        labels = 'method="' + _label(method) + '",endpoint="' + _label(endpoint) + '"'
+        cumulative = 0
+        for i in range(len(LATENCY_BUCKETS)):
+            cumulative = cumulative + stats["buckets"][i]
+            lines.append("http_request_duration_seconds_bucket{" + labels +
+                         ',le="' + str(LATENCY_BUCKETS[i]) + '"} ' + str(cumulative))
+        lines.append("http_request_duration_seconds_bucket{" + labels + ',le="+Inf"} ' +
+                     str(stats["count"]))
+        lines.append("http_request_duration_seconds_sum{" + labels + "} " + repr(stats["seconds"]))
+        lines.append("http_request_duration_seconds_count{" + labels + "} " + str(stats["count"]))
+
+    lines.append("# TYPE http_responses_total counter")
+    for key in sorted(http):
+        method, _, endpoint = key.partition(" ")
+        for status, count in sorted(http[key]["statuses"].items()):
+            lines.append('http_responses_total{method="' + _label(method) + '",endpoint="' +
+                         _label(endpoint) + '",status="' + _label(status) + '"} ' + str(count))
+
+    lines.append("# TYPE http_response_bytes_total counter")
+    for key in sorted(http):
+        method, _, endpoint = key.partition(" ")
+        lines.append('http_response_bytes_total{method="' + _label(method) + '",endpoint="' +
+                     _label(endpoint) + '"} ' + str(http[key]["bytes"]))
+
+    for metric, field, kind in (("sqlite_statement_calls_total", "calls", "counter"),
+                                ("sqlite_statement_seconds_total", "seconds", "counter"),
+                                ("sqlite_statement_traced_total", "traced", "counter"),
+                                ("sqlite_statement_vm_steps_total", "vm_steps", "counter")):
+        lines.append("# TYPE " + metric + " " + kind)
+        for key in sorted(sql):
+            value = sql[key][field]
+            if isinstance(value, float):
+                value = repr(value)
+            lines.append(metric + '{statement="' + _label(key) + '"} ' + str(value))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_summary():
+    if FORMAT == "prometheus":
+        text = prometheus_text()
+    else:
+        text = json.dumps(summary(), indent=2, sort_keys=True) + "\n"
+
+    if OUTPUT:
+        with open(OUTPUT, "w") as f:
+            f.write(text)
+    else:
+        sys.stderr.write(text)
+
+
+if os.getenv("INSTRUMENT"):
+    enable(os.getenv("INSTRUMENT"), os.getenv("INSTRUMENT_OUTPUT"))
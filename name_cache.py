@@ -0,0 +1,174 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+# Like the response cache, kept out of music_data.db
+NAME_CACHE_DB = os.getenv("SPOTIFY_NAME_CACHE_DB", "spotify_name_cache.db")
+
+# How long a resolved name, and a name that found nothing, are trusted
+FOUND_TTL = 30 * 24 * 3600
+NOT_FOUND_TTL = 24 * 3600
+
+DEFAULT_WORKERS = 4
+
+
+def normalize_key(name):
+    """
+    "  Taylor  SWIFT " -> "taylor swift". Only case, Unicode form and
+    whitespace are folded, so names that differ in anything a search
+    would care about keep separate entries.
+    """
+    return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+class NameCache:
+    """
+    SQLite-backed map from (kind, normalized name) to a Spotify ID.
+
+    A name that searched to nothing is stored with a NULL ID, so it is not
+    searched again until NOT_FOUND_TTL passes. Expired entries are searched
+    again; if that search fails, the expired ID is used instead.
+    """
+
+    def __init__(self, db_name=NAME_CACHE_DB, found_ttl=FOUND_TTL, not_found_ttl=NOT_FOUND_TTL):
+        self.db_name = db_name
+        self.found_ttl = found_ttl
+        self.not_found_ttl = not_found_ttl
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_name, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS SpotifyNames (
+                    kind TEXT NOT NULL,
+                    name_key TEXT NOT NULL,
+                    spotify_id TEXT,
+                    spotify_name TEXT,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (kind, name_key)
+                ) WITHOUT ROWID
+            """)
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, kind, names):
+        """
+        Split names into cached and uncached.
+        Returns (hits {name: id or None}, misses [name], stale {name: id}),
+        where stale has the expired IDs of misses that were resolved before.
+        """
+        keys = {}
+        for name in names:
+            keys.setdefault(normalize_key(name), []).append(name)
+
+        now = time.time()
+        rows = {}
+        with self._lock:
+            conn = self._connect()
+            key_list = list(keys)
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, spotify_id, expires_at in conn.execute(
+                        "SELECT name_key, spotify_id, expires_at FROM SpotifyNames "
+                        "WHERE kind = ? AND name_key IN (" + placeholders + ")",
+                        [kind] + chunk):
+                    rows[key] = (spotify_id, expires_at)
+
+        hits = {}
+        misses = []
+        stale = {}
+        for key, key_names in keys.items():
+            row = rows.get(key)
+            if row is not None and row[1] > now:
+                for name in key_names:
+                    hits[name] = row[0]
+                continue
+            misses.extend(key_names)
+            if row is not None and row[0] is not None:
+                for name in key_names:
+                    stale[name] = row[0]
+
+        self.stats["hits"] = self.stats["hits"] + len(hits)
+        self.stats["misses"] = self.stats["misses"] + len(misses)
+        return hits, misses, stale
+
+    def store(self, kind, found):
+        """
+        found: {name: search result dict with "id" and "name", or None}
+        """
+        now = time.time()
+        rows = []
+        for name, item in found.items():
+            if item is None:
+                rows.append((kind, normalize_key(name), None, None, now + self.not_found_ttl))
+            else:
+                rows.append((kind, normalize_key(name), item["id"], item.get("name"),
+                             now + self.found_ttl))
+
+        with self._lock:
+            self._connect().executemany(
+                "INSERT OR REPLACE INTO SpotifyNames "
+                "(kind, name_key, spotify_id, spotify_name, expires_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def resolve(self, kind, names, search, max_workers=DEFAULT_WORKERS):
+        """
+        Return {name: Spotify ID or None} for every name.
+
+        search(name) must return the best search result (a dict with "id")
+        or None. It is only called for names that are not cached, once per
+        normalized name, from up to max_workers threads at a time.
+        """
+        hits, misses, stale = self.lookup(kind, names)
+        if not misses:
+            return hits
+
+        # One search per key, for the first spelling that asked for it
+        queries = {}
+        for name in misses:
+            queries.setdefault(normalize_key(name), name)
+
+        found = {}
+        failed = None
+        workers = max(1, min(max_workers, len(queries)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = dict((key, pool.submit(search, name)) for key, name in queries.items())
+            for key, future in futures.items():
+                try:
+                    found[key] = future.result()
+                except Exception as e:
+                    failed = failed or e
+
+        self.store(kind, dict((queries[key], item) for key, item in found.items()))
+
+        results = dict(hits)
+        for name in misses:
+            key = normalize_key(name)
+            if key in found:
+                item = found[key]
+                results[name] = None if item is None else item["id"]
+            elif name in stale:
+                self.stats["stale"] = self.stats["stale"] + 1
+                results[name] = stale[name]
+            else:
+                raise failed
+        return results
+
+    def print_stats(self):
+        print(f"Name cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+              f"{self.stats['stale']} served stale")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
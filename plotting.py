@@ -0,0 +1,10 @@
+def get_pyplot():
+    """
+    Import matplotlib.pyplot on first use, with the Agg backend so charts
+    are written to files and nothing tries to open a window. Reports that
+    only print text never pay for the matplotlib import.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
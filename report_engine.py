@@ -0,0 +1,237 @@
+"""
+Run each report query once and write the result in several formats.
+
+    python report_engine.py genres --format txt,csv,json,png
+    python report_engine.py genres --format json --refresh 30   # dashboard loop
+
+A ReportEngine keeps results for as long as the database is unchanged.
+The cache key is PRAGMA data_version, which changes when another
+connection commits, plus this connection's total_changes, which covers
+its own writes. Refreshing with unchanged data therefore costs two PRAGMA
+reads. Numbers are kept at full precision; sinks round only when they
+format them.
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+
+import schema
+from plotting import get_pyplot
+
+DB_NAME = "music_data.db"
+
+GENRE_COLORS = ['red', 'orange', 'yellow', 'green', 'blue', 'purple',
+                'lightcoral', 'peachpuff', 'wheat', 'lightgreen', 'lightblue', 'plum',
+                'darkred', 'darkorange', 'gold', 'darkgreen', 'darkblue', 'indigo', 'grey']
+
+
+def get_genre_counts(cur):
+    # Songs per genre, kept up to date in GenreStats by triggers on Songs
+    cur.execute("""
+        SELECT g.genre_name, gs.song_count
+        FROM GenreStats gs
+        JOIN Genres g ON gs.genre_id = g.genre_id
+        WHERE gs.song_count > 0
+        ORDER BY g.genre_name
+    """)
+    return cur.fetchall()
+
+
+def get_total_songs(cur):
+    # Same as COUNT(*) FROM Songs; songs with no genre are under genre_id 0
+    cur.execute("SELECT IFNULL(SUM(song_count), 0) FROM GenreStats")
+    return cur.fetchone()[0]
+
+
+def genre_distribution(cur):
+    """
+    Songs per genre and each genre's share of all songs, in percent.
+    """
+    total_songs = get_total_songs(cur)
+    rows = []
+    for genre_name, count in get_genre_counts(cur):
+        percentage = 0.0
+        if total_songs:
+            percentage = count / total_songs * 100
+        rows.append((genre_name, count, percentage))
+    return rows
+
+
+# name -> how to compute a report and how each sink should present it
+REPORTS = {
+    "genres": {
+        "compute": genre_distribution,
+        "columns": ["genre", "count", "percentage"],
+        "basename": "Spotify_Calculations",
+        "text_header": "Genre Percentages:\n=================\n",
+        "text_line": "Genre: {genre}, Count: {count}, Percentage: {percentage}%\n",
+        "chart": {
+            "x": "genre",
+            "y": "count",
+            "title": "Number of Songs per Genre in Billboard Top 100",
+            "xlabel": "Genre",
+            "ylabel": "Number of Songs",
+            "colors": GENRE_COLORS,
+            "basename": "spotify_genre_counts"
+        }
+    },
+}
+
+
+def write_text(report, rows, filename):
+    with open(filename, "w") as f:
+        f.write(report["text_header"])
+        for row in rows:
+            values = {}
+            for column, value in zip(report["columns"], row):
+                if isinstance(value, float):
+                    value = round(value, 2)
+                values[column] = value
+            f.write(report["text_line"].format(**values))
+
+
+def write_csv(report, rows, filename):
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(report["columns"])
+        writer.writerows(rows)
+
+
+def write_json(report, rows, filename):
+    with open(filename, "w") as f:
+        json.dump([dict(zip(report["columns"], row)) for row in rows], f, indent=2)
+        f.write("\n")
+
+
+def write_png(report, rows, filename):
+    chart = report["chart"]
+    x_index = report["columns"].index(chart["x"])
+    y_index = report["columns"].index(chart["y"])
+    labels = [row[x_index] for row in rows]
+    values = [row[y_index] for row in rows]
+
+    plt = get_pyplot()
+    plt.figure()
+    colors = chart.get("colors")
+    if colors and len(labels) <= len(colors):
+        plt.bar(labels, values, color=colors[:len(labels)])
+    else:
+        plt.bar(labels, values)
+    plt.xlabel(chart["xlabel"])
+    plt.ylabel(chart["ylabel"])
+    plt.title(chart["title"])
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+    plt.savefig(filename)
+    plt.close()
+
+
+# format -> (file extension, writer)
+SINKS = {
+    "txt": (".txt", write_text),
+    "csv": (".csv", write_csv),
+    "json": (".json", write_json),
+    "png": (".png", write_png),
+}
+
+
+def default_outputs(name, formats, out_dir="."):
+    """
+    {format: filename} for a report, e.g. Spotify_Calculations.txt and
+    spotify_genre_counts.png for the genres report.
+    """
+    report = REPORTS[name]
+    outputs = {}
+    for fmt in formats:
+        if fmt not in SINKS:
+            raise ValueError("unknown report format: " + fmt)
+        basename = report["basename"]
+        if fmt == "png":
+            basename = report["chart"]["basename"]
+        outputs[fmt] = os.path.join(out_dir, basename + SINKS[fmt][0])
+    return outputs
+
+
+class ReportEngine:
+    def __init__(self, conn):
+        self.conn = conn
+        self.cache = {}
+        self.written = {}
+        self.hits = 0
+        self.misses = 0
+
+    def data_key(self):
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        return data_version, self.conn.total_changes
+
+    def run(self, name):
+        """
+        Rows for report name, recomputed only if the data has changed.
+        """
+        key = self.data_key()
+        cached = self.cache.get(name)
+        if cached is not None and cached[0] == key:
+            self.hits = self.hits + 1
+            return cached[1]
+
+        self.misses = self.misses + 1
+        rows = REPORTS[name]["compute"](self.conn.cursor())
+        self.cache[name] = (key, rows)
+        return rows
+
+    def render(self, name, outputs):
+        """
+        Run report name once and write it to every {format: filename}
+        in outputs. Files already written from the same data are left
+        alone. Returns the rows.
+        """
+        report = REPORTS[name]
+        rows = self.run(name)
+        key = self.cache[name][0]
+        for fmt, filename in outputs.items():
+            if self.written.get(filename) == key and os.path.exists(filename):
+                continue
+            SINKS[fmt][1](report, rows, filename)
+            self.written[filename] = key
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write reports in several formats from one query.")
+    parser.add_argument("report", choices=sorted(REPORTS))
+    parser.add_argument("--format", default="txt", help="comma-separated: " + ",".join(SINKS))
+    parser.add_argument("--out-dir", default=".")
+    parser.add_argument("--refresh", type=float, default=0,
+                        help="keep running and re-render every this many seconds")
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    formats = [fmt.strip() for fmt in args.format.split(",") if fmt.strip()]
+    os.makedirs(args.out_dir, exist_ok=True)
+    outputs = default_outputs(args.report, formats, args.out_dir)
+
+    conn = schema.connect(args.db)
+    engine = ReportEngine(conn)
+    try:
+        while True:
+            started = time.perf_counter()
+            misses = engine.misses
+            engine.render(args.report, outputs)
+            state = "recomputed" if engine.misses > misses else "cached"
+            print("{0}: wrote {1} ({2}, {3:.1f} ms)".format(
+                args.report, ", ".join(outputs.values()), state,
+                (time.perf_counter() - started) * 1000))
+            if not args.refresh:
+                break
+            time.sleep(args.refresh)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Lives next to music_data.db but in its own file, so cached responses
+# never end up in the repo's database
+CACHE_DB = os.getenv("HTTP_CACHE_DB", "http_cache.db")
+
+# Total size of cached bodies before least-recently-used rows are dropped
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# (endpoint name, URL pattern, time to live in seconds)
+# URLs that match no rule are never cached. /v1/search is left out on
+# purpose: name_cache.NameCache owns name lookups and their TTLs, and a
+# cached search body would outlive its not-found TTL.
+CACHE_RULES = [
+    ("artist", r"^https://api\.spotify\.com/v1/artists/[^/?]+$", 24 * 3600),
+]
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of GET response bodies, keyed by URL.
+
+    Fresh entries are answered locally. Expired entries that came with an
+    ETag are revalidated with If-None-Match, so an unchanged resource costs
+    a 304 instead of a full download. Hits, misses and revalidations are
+    counted per endpoint.
+    """
+
+    def __init__(self, db_name=CACHE_DB, max_bytes=MAX_CACHE_BYTES, rules=CACHE_RULES):
+        self.db_name = db_name
+        self.max_bytes = max_bytes
+        self.rules = [(name, re.compile(pattern), ttl) for name, pattern, ttl in rules]
+        self.stats = {}
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened on first use so importing a module that owns a cache is free
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_name, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ResponseCache (
+                    url TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    etag TEXT,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_response_cache_last_used
+                ON ResponseCache(last_used)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ResponseCacheStats (
+                    endpoint TEXT PRIMARY KEY,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    misses INTEGER NOT NULL DEFAULT 0,
+                    revalidated INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    def rule_for(self, url):
+        """
+        Return (endpoint name, ttl) for url, or None if it is not cacheable.
+        """
+        for name, pattern, ttl in self.rules:
+            if pattern.search(url):
+                return name, ttl
+        return None
+
+    def _count(self, endpoint, field):
+        counts = self.stats.setdefault(endpoint, {"hits": 0, "misses": 0, "revalidated": 0})
+        counts[field] = counts[field] + 1
+
+    def peek(self, url):
+        """
+        Return the cached body for url if it is still fresh, else None.
+        Counts as a hit or a miss for url's endpoint.
+        """
+        rule = self.rule_for(url)
+        if rule is None:
+            return None
+        endpoint = rule[0]
+
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT body FROM ResponseCache WHERE url = ? AND expires_at > ?",
+                (url, now)
+            ).fetchone()
+
+            if row is None:
+                self._count(endpoint, "misses")
+                return None
+
+            conn.execute("UPDATE ResponseCache SET last_used = ? WHERE url = ?",
+                         (now, url))
+            self._count(endpoint, "hits")
+            return row[0]
+
+    def put(self, url, body, etag=None):
+        """
+        Store body for url, e.g. one artist taken from a multi-artist
+        response, so later single lookups can be answered locally.
+        """
+        rule = self.rule_for(url)
+        if rule is None:
+            return
+
+        with self._lock:
+            self._store(self._connect(), url, body, etag, rule[1])
+
+    def _store(self, conn, url, body, etag, ttl):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO ResponseCache "
+            "(url, body, etag, expires_at, last_used, size) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (url, body, etag, now + ttl, now, len(body))
+        )
+        self._evict(conn)
+
+    def get(self, url, fetch):
+        """
+        Return the response body for url.
+
+        fetch(extra_headers) must perform the real GET and return a
+        requests-style response. It is only called on a miss or when an
+        expired entry has to be revalidated.
+        """
+        rule = self.rule_for(url)
+        if rule is None:
+            return fetch({}).content
+        endpoint, ttl = rule
+
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT body, etag, expires_at FROM ResponseCache WHERE url = ?",
+                (url,)
+            ).fetchone()
+
+            if row is not None and row[2] > now:
+                conn.execute("UPDATE ResponseCache SET last_used = ? WHERE url = ?",
+                             (now, url))
+                self._count(endpoint, "hits")
+                return row[0]
+
+        extra_headers = {}
+        if row is not None and row[1]:
+            extra_headers["If-None-Match"] = row[1]
+
+        response = fetch(extra_headers)
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+
+            if response.status_code == 304 and row is not None:
+                conn.execute(
+                    "UPDATE ResponseCache SET expires_at = ?, last_used = ? WHERE url = ?",
+                    (now + ttl, now, url)
+                )
+                self._count(endpoint, "revalidated")
+                return row[0]
+
+            self._count(endpoint, "misses")
+            if response.status_code == 200:
+                self._store(conn, url, response.content,
+                            response.headers.get("ETag"), ttl)
+
+        return response.content
+
+    def _evict(self, conn):
+        # Drop least recently used entries until the cache fits in max_bytes
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ResponseCache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        victims = []
+        for url, size in conn.execute("SELECT url, size FROM ResponseCache ORDER BY last_used"):
+            victims.append((url,))
+            total = total - size
+            if total <= self.max_bytes:
+                break
+        conn.executemany("DELETE FROM ResponseCache WHERE url = ?", victims)
+
+    def save_stats(self):
+        """
+        Add this run's counters to the running totals in ResponseCacheStats.
+        """
+        if not self.stats:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            rows = []
+            for endpoint, counts in self.stats.items():
+                rows.append((endpoint, counts["hits"], counts["misses"], counts["revalidated"]))
+            conn.executemany("""
+                INSERT INTO ResponseCacheStats (endpoint, hits, misses, revalidated)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(endpoint) DO UPDATE SET
+                    hits = hits + excluded.hits,
+                    misses = misses + excluded.misses,
+                    revalidated = revalidated + excluded.revalidated
+            """, rows)
+            self.stats = {}
+
+    def print_stats(self):
+        """
+        Print this run's hit/miss counters per endpoint.
+        """
+        for endpoint in sorted(self.stats):
+            counts = self.stats[endpoint]
+            saved = counts["hits"] + counts["revalidated"]
+            total = saved + counts["misses"]
+            print(f"Cache {endpoint}: {counts['hits']} hits, "
+                  f"{counts['revalidated']} revalidated, {counts['misses']} misses "
+                  f"({saved}/{total} downloads saved)")
+
+    def close(self):
+        self.save_stats()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,258 @@
+"""
+Keep music_data.db current by polling Last.fm and Spotify from one
+long-running process.
+
+    python scheduler.py --lastfm-interval 900 --playlist "old songs(2000-2017)"
+    python scheduler.py --no-spotify --depth 500 --max-interval 21600
+
+Each source has its own interval. A poll that finds nothing new (for
+Last.fm: no new artist and no change in the ranking) doubles that
+source's wait (up to --max-interval); a poll that changes something
+resets it, and a poll that stopped at --spotify-batch runs again right
+away. Errors back off the same way as an unchanged poll.
+
+The database connection, the Spotify token, the HTTP sessions (kept by
+http_client) and the artist/genre ID maps are created once and reused by
+every poll. There is no 25-row cap: the whole Last.fm chart down to
+--depth and every new playlist track are stored.
+
+SIGTERM or SIGINT stops the loop. A poll that is running is allowed to
+finish, so its writes are committed, before the connection is closed.
+"""
+
+import argparse
+import signal
+import threading
+import time
+import traceback
+
+import schema
+import store_lastfm
+from chart_history import LASTFM, SPOTIFY
+
+DB_NAME = "music_data.db"
+
+DEFAULT_LASTFM_INTERVAL = 15 * 60
+DEFAULT_SPOTIFY_INTERVAL = 60 * 60
+DEFAULT_MAX_INTERVAL = 6 * 60 * 60
+
+# Wait multiplier after a poll that found nothing new
+BACKOFF_FACTOR = 2.0
+
+# Poll outcomes
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+MORE = "more"
+FAILED = "failed"
+
+
+def log(message):
+    print(time.strftime("%Y-%m-%d %H:%M:%S") + " " + message, flush=True)
+
+
+class Source:
+    """
+    One thing to poll. poll() returns CHANGED, UNCHANGED or MORE.
+    """
+
+    name = None
+
+    def __init__(self, interval, max_interval):
+        self.base_interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.interval = interval
+        self.next_run = 0.0
+
+    def poll(self, conn, cur):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def schedule(self, outcome, now):
+        """
+        Pick the next run time from the outcome of the last poll.
+        """
+        if outcome == MORE:
+            self.interval = self.base_interval
+            self.next_run = now
+            return
+        if outcome == CHANGED:
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * BACKOFF_FACTOR)
+        self.next_run = now + self.interval
+
+
+class LastfmSource(Source):
+    name = LASTFM
+
+    def __init__(self, interval, max_interval, depth):
+        Source.__init__(self, interval, max_interval)
+        self.depth = depth
+
+    def chart(self, cur):
+        # Stored artists in chart order; artists off the chart have no rank
+        cur.execute("SELECT artist_name FROM LastfmTopArtists "
+                    "WHERE rank IS NOT NULL ORDER BY rank")
+        return [row[0] for row in cur.fetchall()]
+
+    def poll(self, conn, cur):
+        # Listeners and playcounts move on almost every fetch, so only a
+        # new artist or a change in who is ranked where counts as a change
+        before = self.chart(cur)
+        inserted, updated, unchanged = store_lastfm.store_lastfm_data(
+            conn, cur, depth=self.depth, max_new_per_run=None)
+        if inserted or self.chart(cur) != before:
+            return CHANGED
+        return UNCHANGED
+
+
+class SpotifySource(Source):
+    name = SPOTIFY
+
+    def __init__(self, interval, max_interval, playlists, batch_size):
+        Source.__init__(self, interval, max_interval)
+        self.playlists = playlists
+        self.batch_size = batch_size
+        self.token = None
+        self.artist_map = None
+        self.genre_map = None
+
+    def resolve_playlist(self, value):
+        import Spotify_Data as spotify
+        from crawler import parse_spotify_id
+
+        playlist_id = parse_spotify_id(value, "playlist")
+        if playlist_id is None:
+            playlist_id = spotify.resolve_playlist_id(self.token, value)
+        if playlist_id is None:
+            raise ValueError("no playlist found for " + repr(value))
+        return playlist_id
+
+    def poll(self, conn, cur):
+        # Spotify_Data loads .env and the response cache on import, so it
+        # is only imported when Spotify is actually polled
+        import Spotify_Data as spotify
+        from store_spotify import get_ingest_state, load_id_maps
+
+        if self.token is None:
+            self.token = spotify.get_token()
+        if self.artist_map is None:
+            self.artist_map, self.genre_map = load_id_maps(cur)
+
+        outcome = UNCHANGED
+        for value in self.playlists:
+            playlist_id = self.resolve_playlist(value)
+            before = get_ingest_state(cur, playlist_id)
+            try:
+                inserted = spotify.ingest_playlist(self.token, conn, cur, playlist_id,
+                                                   self.artist_map, self.genre_map,
+                                                   self.batch_size)
+            except Exception:
+                # A failed batch leaves the maps ahead of the rolled-back
+                # database, so they are read again next time
+                conn.rollback()
+                self.artist_map = None
+                raise
+            after = get_ingest_state(cur, playlist_id)
+
+            if after is not None and after[1] < after[2]:
+                outcome = MORE
+            elif outcome != MORE and (inserted or after != before):
+                outcome = CHANGED
+        return outcome
+
+    def close(self):
+        if self.token is not None:
+            import Spotify_Data as spotify
+            spotify.response_cache.print_stats()
+            spotify.response_cache.close()
+            spotify.name_cache.print_stats()
+            spotify.name_cache.close()
+
+
+class Scheduler:
+    def __init__(self, db_name, sources):
+        self.db_name = db_name
+        self.sources = sources
+        self.stopping = threading.Event()
+        self.conn = None
+        self.cur = None
+
+    def stop(self, signum=None, frame=None):
+        if not self.stopping.is_set():
+            log("Stopping after the current poll.")
+        self.stopping.set()
+
+    def run_once(self, source):
+        started = time.monotonic()
+        try:
+            outcome = source.poll(self.conn, self.cur)
+        except Exception:
+            traceback.print_exc()
+            # The connection is shared, so a half-written poll must not be
+            # committed by the next source's poll
+            self.conn.rollback()
+            outcome = FAILED
+        finished = time.monotonic()
+        source.schedule(outcome, finished)
+        log("{0}: {1} in {2:.1f}s, next poll in {3:.0f}s".format(
+            source.name, outcome, finished - started, source.next_run - finished))
+
+    def run(self):
+        self.conn = schema.connect(self.db_name)
+        self.cur = self.conn.cursor()
+        log("Polling " + ", ".join(source.name for source in self.sources) + ".")
+        try:
+            while not self.stopping.is_set():
+                source = min(self.sources, key=lambda item: item.next_run)
+                wait = source.next_run - time.monotonic()
+                if wait > 0:
+                    # Wakes up early when a signal sets stopping
+                    self.stopping.wait(wait)
+                    continue
+                self.run_once(source)
+        finally:
+            for source in self.sources:
+                source.close()
+            self.conn.close()
+            log("Stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll Last.fm and Spotify into music_data.db until stopped.")
+    parser.add_argument("--lastfm-interval", type=float, default=DEFAULT_LASTFM_INTERVAL,
+                        help="seconds between Last.fm polls while the chart is changing")
+    parser.add_argument("--spotify-interval", type=float, default=DEFAULT_SPOTIFY_INTERVAL,
+                        help="seconds between Spotify polls while playlists are changing")
+    parser.add_argument("--max-interval", type=float, default=DEFAULT_MAX_INTERVAL,
+                        help="longest wait after repeated unchanged polls")
+    parser.add_argument("--depth", type=int, default=100, help="how far down the Last.fm chart to track")
+    parser.add_argument("--playlist", action="append", default=[],
+                        help="playlist name, ID, URI or URL (repeatable)")
+    parser.add_argument("--spotify-batch", type=int, default=None,
+                        help="most new songs per Spotify poll (default: no limit)")
+    parser.add_argument("--no-lastfm", action="store_true")
+    parser.add_argument("--no-spotify", action="store_true")
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    sources = []
+    if not args.no_lastfm:
+        sources.append(LastfmSource(args.lastfm_interval, args.max_interval, args.depth))
+    if not args.no_spotify:
+        playlists = args.playlist or ["old songs(2000-2017)"]
+        sources.append(SpotifySource(args.spotify_interval, args.max_interval, playlists,
+                                     args.spotify_batch))
+    if not sources:
+        parser.error("nothing to poll")
+
+    scheduler = Scheduler(args.db, sources)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    scheduler.run()
+
+
+if __name__ == "__main__":
+    main()
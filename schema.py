@@ -0,0 +1,295 @@
+import sqlite3
+import sys
+
+import instrumentation
+
+DB_NAME = "music_data.db"
+
+# Settings applied to every connection. WAL lets reports read while an
+# ingest is writing; synchronous=NORMAL is safe in WAL mode and avoids an
+# fsync per commit. cache_size is in KiB when negative.
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+# MIGRATIONS[n - 1] takes a database from version n - 1 to version n.
+# The version is stored in PRAGMA user_version. Append new migrations to
+# the end; never edit one that has already shipped.
+MIGRATIONS = [
+    # 1: the original tables from Spotify_Data.py and store_lastfm.py.
+    # IF NOT EXISTS because databases made before this module already
+    # have them at user_version 0.
+    [
+        """CREATE TABLE IF NOT EXISTS Artists (
+            artist_id INTEGER PRIMARY KEY,
+            artist_name TEXT UNIQUE NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS Genres (
+            genre_id INTEGER PRIMARY KEY,
+            genre_name TEXT UNIQUE NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS Songs (
+            song_name TEXT NOT NULL,
+            artist_id INTEGER,
+            popularity INTEGER,
+            genre_id INTEGER,
+            UNIQUE(song_name, artist_id),
+            FOREIGN KEY (artist_id) REFERENCES Artists(artist_id),
+            FOREIGN KEY (genre_id) REFERENCES Genres(genre_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS LastfmTopArtists (
+            artist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            artist_name TEXT UNIQUE,
+            listeners INTEGER,
+            playcount INTEGER,
+            rank INTEGER
+        )""",
+    ],
+
+    # 2: incremental playlist ingest (IngestState cursor + PlaylistTracks)
+    [
+        """CREATE TABLE IF NOT EXISTS IngestState (
+            playlist_id TEXT PRIMARY KEY,
+            snapshot_id TEXT,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        )""",
+        """CREATE TABLE IF NOT EXISTS PlaylistTracks (
+            playlist_id TEXT NOT NULL,
+            track_id TEXT NOT NULL,
+            position INTEGER,
+            song_name TEXT NOT NULL,
+            artist_id INTEGER,
+            PRIMARY KEY (playlist_id, track_id)
+        )""",
+        """CREATE INDEX IF NOT EXISTS idx_playlist_tracks_song
+            ON PlaylistTracks(song_name, artist_id)""",
+    ],
+
+    # 3: indexes for the reports. The genre and artist joins/GROUP BYs in
+    # Spotify_Calculation.py and Spotify_Visual.py can be answered from
+    # these indexes alone, and the Last.fm analysis reads in rank order.
+    [
+        """CREATE INDEX IF NOT EXISTS idx_songs_genre
+            ON Songs(genre_id, artist_id, popularity)""",
+        """CREATE INDEX IF NOT EXISTS idx_songs_artist
+            ON Songs(artist_id, genre_id)""",
+        """CREATE INDEX IF NOT EXISTS idx_lastfm_rank
+            ON LastfmTopArtists(rank)""",
+        "ANALYZE",
+    ],
+
+    # 4: chart history. Every fetch of a chart is one ChartSnapshots row;
+    # the per-artist numbers hang off it with small integer keys. The
+    # primary keys serve "this artist over time", the snapshot indexes
+    # serve "everyone in this snapshot".
+    [
+        """CREATE TABLE IF NOT EXISTS ChartSnapshots (
+            snapshot_id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            fetched_at INTEGER NOT NULL
+        )""",
+        """CREATE INDEX IF NOT EXISTS idx_chart_snapshots_source_time
+            ON ChartSnapshots(source, fetched_at)""",
+        """CREATE TABLE IF NOT EXISTS LastfmArtistSnapshots (
+            artist_id INTEGER NOT NULL,
+            snapshot_id INTEGER NOT NULL,
+            rank INTEGER,
+            listeners INTEGER,
+            playcount INTEGER,
+            PRIMARY KEY (artist_id, snapshot_id)
+        ) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS idx_lastfm_snapshots_snapshot
+            ON LastfmArtistSnapshots(snapshot_id, rank)""",
+        """CREATE TABLE IF NOT EXISTS SpotifyArtistSnapshots (
+            artist_id INTEGER NOT NULL,
+            snapshot_id INTEGER NOT NULL,
+            popularity INTEGER,
+            PRIMARY KEY (artist_id, snapshot_id)
+        ) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS idx_spotify_snapshots_snapshot
+            ON SpotifyArtistSnapshots(snapshot_id)""",
+    ],
+
+    # 5: GenreStats, the song count per genre kept current by triggers on
+    # Songs, so the genre reports read one row per genre. Songs without a
+    # genre are counted under genre_id 0 (never a real rowid), which keeps
+    # SUM(song_count) equal to COUNT(*) FROM Songs.
+    [
+        """CREATE TABLE IF NOT EXISTS GenreStats (
+            genre_id INTEGER PRIMARY KEY,
+            song_count INTEGER NOT NULL DEFAULT 0
+        )""",
+        """DELETE FROM GenreStats""",
+        """INSERT INTO GenreStats (genre_id, song_count)
+            SELECT IFNULL(genre_id, 0), COUNT(*) FROM Songs GROUP BY IFNULL(genre_id, 0)""",
+        """CREATE TRIGGER IF NOT EXISTS trg_songs_insert_genre_stats
+            AFTER INSERT ON Songs
+            BEGIN
+                INSERT INTO GenreStats (genre_id, song_count)
+                VALUES (IFNULL(NEW.genre_id, 0), 1)
+                ON CONFLICT(genre_id) DO UPDATE SET song_count = song_count + 1;
+            END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_songs_delete_genre_stats
+            AFTER DELETE ON Songs
+            BEGIN
+                UPDATE GenreStats SET song_count = song_count - 1
+                WHERE genre_id = IFNULL(OLD.genre_id, 0);
+            END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_songs_update_genre_stats
+            AFTER UPDATE OF genre_id ON Songs
+            WHEN IFNULL(OLD.genre_id, 0) != IFNULL(NEW.genre_id, 0)
+            BEGIN
+                UPDATE GenreStats SET song_count = song_count - 1
+                WHERE genre_id = IFNULL(OLD.genre_id, 0);
+                INSERT INTO GenreStats (genre_id, song_count)
+                VALUES (IFNULL(NEW.genre_id, 0), 1)
+                ON CONFLICT(genre_id) DO UPDATE SET song_count = song_count + 1;
+            END""",
+    ],
+
+    # 6: cross-source artist matching (artist_matching.py). ArtistKeys has
+    # the normalized name of every artist already looked at, per source;
+    # ArtistMatches maps each Last.fm artist to its Spotify artist.
+    [
+        """CREATE TABLE IF NOT EXISTS ArtistKeys (
+            source TEXT NOT NULL,
+            artist_id INTEGER NOT NULL,
+            name_key TEXT NOT NULL,
+            PRIMARY KEY (source, artist_id)
+        ) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS idx_artist_keys_key
+            ON ArtistKeys(name_key, source)""",
+        """CREATE TABLE IF NOT EXISTS ArtistMatches (
+            lastfm_artist_id INTEGER PRIMARY KEY,
+            spotify_artist_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            method TEXT NOT NULL,
+            matched_at INTEGER NOT NULL
+        )""",
+        """CREATE INDEX IF NOT EXISTS idx_artist_matches_spotify
+            ON ArtistMatches(spotify_artist_id)""",
+    ],
+
+    # 7: every Spotify genre of an artist, in Spotify's order (position 0
+    # is the one Songs.genre_id keeps). Backfilled from Songs, which only
+    # ever stored the first genre; "Unknown" is not a genre and is left out.
+    [
+        """CREATE TABLE IF NOT EXISTS ArtistGenres (
+            artist_id INTEGER NOT NULL,
+            genre_id INTEGER NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (artist_id, genre_id)
+        ) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS idx_artist_genres_genre
+            ON ArtistGenres(genre_id, artist_id)""",
+        """INSERT OR IGNORE INTO ArtistGenres (artist_id, genre_id, position)
+            SELECT DISTINCT s.artist_id, s.genre_id, 0
+            FROM Songs s
+            JOIN Genres g ON g.genre_id = s.genre_id
+            WHERE s.artist_id IS NOT NULL AND g.genre_name != 'Unknown'""",
+    ],
+
+    # 8: normalize_name no longer cuts names at a bare "with", so keys and
+    # matches made before are dropped; artist_matching.py rebuilds them
+    # on its next run.
+    [
+        "DELETE FROM ArtistMatches",
+        "DELETE FROM ArtistKeys",
+    ],
+
+    # 9: LastfmArtists gives every artist ever seen on the Last.fm chart an
+    # ID, so snapshots can record artists that LastfmTopArtists has not
+    # taken in yet. LastfmTopArtists rows share these IDs; the backfill
+    # keeps the IDs existing rows and snapshots already use.
+    [
+        """CREATE TABLE IF NOT EXISTS LastfmArtists (
+            artist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            artist_name TEXT UNIQUE NOT NULL
+        )""",
+        """INSERT OR IGNORE INTO LastfmArtists (artist_id, artist_name)
+            SELECT artist_id, artist_name FROM LastfmTopArtists
+            WHERE artist_name IS NOT NULL""",
+    ],
+
+    # 10: the Spotify ID of each playlist track's first artist, so every
+    # artist on a playlist can be sampled for popularity on each run, even
+    # when the playlist itself has not changed. Rows stored before stay
+    # NULL until the playlist's next full scan fills them in.
+    [
+        "ALTER TABLE PlaylistTracks ADD COLUMN spotify_artist_id TEXT",
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def configure(conn):
+    """
+    Apply PRAGMAS to a connection.
+    """
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Bring the database up to SCHEMA_VERSION, one migration per transaction.
+    Returns the version the database started at.
+    """
+    start_version = get_version(conn)
+
+    for version in range(start_version + 1, SCHEMA_VERSION + 1):
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if get_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in MIGRATIONS[version - 1]:
+                cur.execute(statement)
+            cur.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return start_version
+
+
+def connect(db_name=DB_NAME, check_same_thread=True):
+    """
+    Open db_name with the standard PRAGMAS and an up-to-date schema.
+    """
+    if instrumentation.ENABLED:
+        conn = instrumentation.connect(db_name, timeout=30, check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(db_name, timeout=30, check_same_thread=check_same_thread)
+    configure(conn)
+    migrate(conn)
+    return conn
+
+
+def main():
+    # Upgrade the given databases in place, e.g. python schema.py music_data.db
+    db_names = sys.argv[1:] or [DB_NAME]
+    for db_name in db_names:
+        conn = sqlite3.connect(db_name, timeout=30)
+        configure(conn)
+        start_version = migrate(conn)
+        conn.close()
+        print(f"{db_name}: schema version {start_version} -> {SCHEMA_VERSION}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import base64
+import json
+import sqlite3
+import threading
+import time
+
+from http_client import post
+
+# Kept out of music_data.db so access tokens never end up in the repo
+TOKEN_CACHE_DB = "spotify_token_cache.db"
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+# Refresh this many seconds before Spotify says the token expires
+REFRESH_MARGIN = 60
+
+
+def request_token(client_id, client_secret):
+    """
+    Ask Spotify for a new client-credentials token.
+    Returns (access_token, expires_at) where expires_at is a Unix time.
+    """
+    auth_string = client_id + ":" + client_secret
+    auth_bytes = auth_string.encode("utf-8")
+    auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
+
+    headers = {
+        "Authorization": "Basic " + auth_base64,
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+
+    data = {"grant_type": "client_credentials"}
+    requested_at = time.time()
+    result = post(TOKEN_URL, headers=headers, data=data)
+    json_result = json.loads(result.content)
+
+    token = json_result["access_token"]
+    expires_at = requested_at + int(json_result.get("expires_in", 3600))
+    return token, expires_at
+
+
+class TokenProvider:
+    """
+    Hands out a Spotify access token, reusing a cached one when possible.
+
+    The token and its expiry live in a small SQLite file shared by every
+    process on the machine. Refreshing happens inside a write transaction,
+    so when several workers start together only one of them calls the
+    accounts endpoint and the rest pick up its token.
+    """
+
+    def __init__(self, client_id, client_secret, db_name=TOKEN_CACHE_DB):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.db_name = db_name
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return a token that is valid for at least REFRESH_MARGIN seconds.
+        """
+        if self._is_fresh(self._token, self._expires_at):
+            return self._token
+
+        with self._lock:
+            if self._is_fresh(self._token, self._expires_at):
+                return self._token
+            return self._load_or_refresh(None)
+
+    def refresh(self, stale_token):
+        """
+        Replace a token that the API rejected (HTTP 401).
+        If another thread or process already replaced it, that newer token
+        is returned instead of requesting yet another one.
+        """
+        with self._lock:
+            if self._token is not None and self._token != stale_token:
+                return self._token
+            return self._load_or_refresh(stale_token)
+
+    def _is_fresh(self, token, expires_at):
+        return token is not None and time.time() < expires_at - REFRESH_MARGIN
+
+    def _load_or_refresh(self, stale_token):
+        conn = sqlite3.connect(self.db_name, timeout=30, isolation_level=None)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS SpotifyTokens (
+                    client_id TEXT PRIMARY KEY,
+                    access_token TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+            # Take the write lock before looking, so two processes that both
+            # see an expired token do not both go to the accounts endpoint.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT access_token, expires_at FROM SpotifyTokens "
+                    "WHERE client_id = ?",
+                    (self.client_id,)
+                ).fetchone()
+
+                if (row is not None and row[0] != stale_token
+                        and self._is_fresh(row[0], row[1])):
+                    token, expires_at = row
+                else:
+                    token, expires_at = request_token(self.client_id,
+                                                      self.client_secret)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO SpotifyTokens "
+                        "(client_id, access_token, expires_at) VALUES (?, ?, ?)",
+                        (self.client_id, token, expires_at)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+        self._token = token
+        self._expires_at = expires_at
+        return token
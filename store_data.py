@@ -1,48 +1,50 @@
-import sqlite3
-import requests
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import http_client
+import schema
+from chart_history import lastfm_artist_ids, record_lastfm_snapshot
 
 DB_NAME = "lastfm_data.db"
 
-LASTFM_API_KEY = "147d088f8a1a28a41085abb802b8d9dc"
+LASTFM_API_KEY = os.getenv("LASTFM_API_KEY", "147d088f8a1a28a41085abb802b8d9dc")
+
+# Artists per chart.getTopArtists request, and pages fetched at once
+LASTFM_PAGE_SIZE = 100
+LASTFM_WORKERS = 4
 
 
 def get_connection():
-    conn = sqlite3.connect(DB_NAME)
+    conn = schema.connect(DB_NAME)
     cur = conn.cursor()
     return conn, cur
 
 
 def create_tables(cur):
     """
-    Create the LastfmTopArtists table.
-    artist_id is an integer key.
-    artist_name is UNIQUE so we never store the same string twice.
-    """
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS LastfmTopArtists (
-            artist_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            artist_name TEXT UNIQUE,
-            listeners INTEGER,
-            playcount INTEGER,
-            rank INTEGER
-        )
-    """)
+    Make sure the LastfmTopArtists table exists.
+    The table definitions live in schema.py; this upgrades the database
+    to the current schema version if needed.
+    """
+    schema.migrate(cur.connection)
 
 
-def fetch_lastfm_top_artists():
+def fetch_lastfm_chart_page(page, limit=LASTFM_PAGE_SIZE):
     """
-    Call Last.fm chart.getTopArtists and get up to 100 artists.
-    We rely on the list order for rank (index + 1).
+    Call Last.fm chart.getTopArtists for one page of the chart.
+    Rank comes from the artist's @attr.rank when Last.fm sends one,
+    otherwise from its position in the whole chart.
     """
 
     base_url = "https://ws.audioscrobbler.com/2.0/"
     url = (base_url +
            "?method=chart.gettopartists" +
            "&api_key=" + LASTFM_API_KEY +
-           "&limit=100" +
+           "&page=" + str(page) +
+           "&limit=" + str(limit) +
            "&format=json")
 
-    response = requests.get(url)
+    response = http_client.get(url)
     data = response.json()
 
     artists_block = data["artists"]
@@ -50,7 +52,6 @@ def fetch_lastfm_top_artists():
 
     results = []
 
-    # Walk through the list; index gives us rank.
     for i in range(len(artist_list)):
         artist = artist_list[i]
 
@@ -58,8 +59,10 @@ def fetch_lastfm_top_artists():
         listeners_str = artist["listeners"]
         playcount_str = artist["playcount"]
 
-        # Rank is list position (1-based)
-        rank_value = i + 1
+        rank_value = (page - 1) * limit + i + 1
+        attr = artist.get("@attr", {})
+        if "rank" in attr:
+            rank_value = int(attr["rank"])
 
         artist_dict = {}
         artist_dict["artist_name"] = name
@@ -72,62 +75,256 @@ def fetch_lastfm_top_artists():
     return results
 
 
-def store_lastfm_data(conn, cur):
+def iter_lastfm_chart_pages(depth=100, page_size=LASTFM_PAGE_SIZE, max_workers=LASTFM_WORKERS):
     """
-    Insert up to 25 new artists per run.
-    Avoid duplicates by checking artist_name (UNIQUE).
-    Stop once we reach 100 rows total.
+    Fetch the top `depth` artists, requesting all pages concurrently.
+    Each page's artists are yielded as soon as that page arrives, so
+    pages can come out of order.
     """
+    pages = (depth + page_size - 1) // page_size
+    if pages == 0:
+        return
 
-    # Count existing rows
-    cur.execute("SELECT COUNT(*) FROM LastfmTopArtists")
-    row = cur.fetchone()
-    current_count = row[0]
+    with ThreadPoolExecutor(max_workers=min(max_workers, pages)) as pool:
+        futures = []
+        for page in range(1, pages + 1):
+            futures.append(pool.submit(fetch_lastfm_chart_page, page, page_size))
 
-    if current_count >= 100:
-        print("Already have 100 Last.fm artists. Skipping insert.")
-        return
+        for future in as_completed(futures):
+            artists = []
+            for artist in future.result():
+                if artist["rank"] <= depth:
+                    artists.append(artist)
+            yield artists
+
+
+class ChartRanks:
+    """
+    Keeps ranks consistent across pages fetched at slightly different
+    times. If the chart moves between two page requests, an artist can
+    appear on both pages (or on neither). Duplicates keep their best
+    rank, and final() renumbers everyone 1..N with no gaps or ties.
+    """
+
+    def __init__(self):
+        self.best = {}
+
+    def add_page(self, artists):
+        """
+        Return the artists from this page that are new, or that have a
+        better rank than the copy seen on an earlier page.
+        """
+        fresh = []
+        for artist in artists:
+            current = self.best.get(artist["artist_name"])
+            if current is None or artist["rank"] < current["rank"]:
+                self.best[artist["artist_name"]] = artist
+                fresh.append(artist)
+        return fresh
+
+    def final(self):
+        ordered = sorted(self.best.values(),
+                         key=lambda artist: (artist["rank"], -artist["listeners"]))
+        results = []
+        for i in range(len(ordered)):
+            artist_dict = dict(ordered[i])
+            artist_dict["rank"] = i + 1
+            results.append(artist_dict)
+        return results
+
+
+def fetch_lastfm_top_artists(depth=100):
+    """
+    Get the top `depth` artists from chart.getTopArtists, with ranks that
+    are consistent across pages.
+    """
+    ranks = ChartRanks()
+    for artists in iter_lastfm_chart_pages(depth):
+        ranks.add_page(artists)
+    return ranks.final()
+
+
+def load_lastfm_stats(cur, names):
+    """
+    Return {artist_name: (listeners, playcount, rank)} for the given names
+    that are already stored. Uses one IN query per 500 names.
+    """
+    names = list(names)
+    stats = {}
+    for start in range(0, len(names), 500):
+        chunk = names[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        cur.execute(
+            "SELECT artist_name, listeners, playcount, rank FROM LastfmTopArtists "
+            "WHERE artist_name IN (" + placeholders + ")",
+            chunk
+        )
+        for row in cur.fetchall():
+            stats[row[0]] = (row[1], row[2], row[3])
+    return stats
+
+
+def upsert_lastfm_artists(conn, cur, artists, max_new=None):
+    """
+    Insert new artists and refresh listeners, playcount and rank of the
+    ones we already have, with one executemany in one transaction.
+    Rows whose numbers have not changed are not written. New rows take
+    their artist_id from LastfmArtists, which snapshots use too.
+    max_new caps how many new artists are added (None means no cap).
 
-    max_new_this_run = 100 - current_count
-    if max_new_this_run > 25:
-        max_new_this_run = 25
+    Returns (inserted, updated, unchanged).
+    """
+    existing = load_lastfm_stats(cur, [artist["artist_name"] for artist in artists])
 
-    artists = fetch_lastfm_top_artists()
+    rows = []
+    seen = set()
     inserted = 0
+    updated = 0
+    unchanged = 0
 
     for artist in artists:
         name = artist["artist_name"]
-        listeners = artist["listeners"]
-        playcount = artist["playcount"]
-        rank = artist["rank"]
+        if name in seen:
+            continue
+        seen.add(name)
 
-        # Check if this artist_name is already stored
-        cur.execute(
-            "SELECT 1 FROM LastfmTopArtists WHERE artist_name = ?",
-            (name,)
-        )
-        exists = cur.fetchone()
-        if exists is not None:
+        values = (artist["listeners"], artist["playcount"], artist["rank"])
+        current = existing.get(name)
+
+        if current is None:
+            if max_new is not None and inserted >= max_new:
+                continue
+            inserted = inserted + 1
+        elif current == values:
+            unchanged = unchanged + 1
             continue
+        else:
+            updated = updated + 1
+
+        rows.append((name,) + values)
+
+    ids = lastfm_artist_ids(cur, [row[0] for row in rows])
+    cur.executemany("""
+        INSERT INTO LastfmTopArtists (artist_id, artist_name, listeners, playcount, rank)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(artist_name) DO UPDATE SET
+            listeners = excluded.listeners,
+            playcount = excluded.playcount,
+            rank = excluded.rank
+    """, [(ids[row[0]],) + row for row in rows])
+    conn.commit()
 
-        cur.execute(
-            "INSERT INTO LastfmTopArtists (artist_name, listeners, playcount, rank) "
-            "VALUES (?, ?, ?, ?)",
-            (name, listeners, playcount, rank)
-        )
+    return inserted, updated, unchanged
 
-        inserted = inserted + 1
-        if inserted >= max_new_this_run:
-            break
 
-    conn.commit()
-    print("Inserted " + str(inserted) + " new Last.fm artists.")
+def clear_stale_ranks(cur, artists, depth):
+    """
+    Set rank to NULL for every stored artist ranked within `depth` that is
+    not in `artists`, the chart just fetched down to `depth`, so artists
+    that fell off keep no old rank. Ranks below depth were not fetched and
+    are left alone. Does not commit; the caller writes the new ranks in
+    the same transaction.
+    """
+    names = set(artist["artist_name"] for artist in artists)
+    cur.execute("SELECT artist_name FROM LastfmTopArtists WHERE rank <= ?", (depth,))
+    stale = [(row[0],) for row in cur.fetchall() if row[0] not in names]
+    cur.executemany("UPDATE LastfmTopArtists SET rank = NULL WHERE artist_name = ?", stale)
+    return len(stale)
+
+
+def store_lastfm_data(conn, cur, depth=100, max_new_per_run=25):
+    """
+    Fetch the top `depth` artists and store each page as it arrives.
+    Insert up to max_new_per_run new artists per run, the best ranked
+    first, stopping once we reach `depth` rows total
+    (max_new_per_run=None removes both caps). With a cap, new artists
+    are held back until every page is in, since pages arrive in any
+    order; artists we already have are still written page by page.
+    Ranks are settled with one final upsert once all pages are in.
+    Artists we already have get their current listeners, playcount and
+    rank, artists that fell out of the top `depth` get a NULL rank, and
+    the whole fetch is kept as a chart snapshot.
+    Returns (inserted, updated, unchanged), counting each artist once
+    against what was stored before this run.
+    """
+
+    max_new_this_run = None
+    if max_new_per_run is not None:
+        cur.execute("SELECT COUNT(*) FROM LastfmTopArtists")
+        row = cur.fetchone()
+        current_count = row[0]
+
+        max_new_this_run = depth - current_count
+        if max_new_this_run > max_new_per_run:
+            max_new_this_run = max_new_per_run
+        if max_new_this_run < 0:
+            max_new_this_run = 0
+
+    ranks = ChartRanks()
+    # artist_name -> stored (listeners, playcount, rank) before this run,
+    # or None for artists we did not have
+    before = {}
+
+    for artists in iter_lastfm_chart_pages(depth):
+        fresh = ranks.add_page(artists)
+
+        names = [artist["artist_name"] for artist in fresh
+                 if artist["artist_name"] not in before]
+        stored = load_lastfm_stats(cur, names)
+        for name in names:
+            before[name] = stored.get(name)
+
+        if max_new_this_run is not None:
+            # The cap has to go to the best ranked new artists, and pages
+            # arrive in any order, so new artists wait for the whole chart
+            fresh = [artist for artist in fresh if before[artist["artist_name"]] is not None]
+        upsert_lastfm_artists(conn, cur, fresh)
+
+    # Pages can race against a changing chart, so settle the final ranks
+    # once every page is in
+    artists = ranks.final()
+
+    kept = artists
+    if max_new_this_run is not None:
+        kept = []
+        new = 0
+        for artist in artists:
+            if before[artist["artist_name"]] is None:
+                if new >= max_new_this_run:
+                    continue
+                new = new + 1
+            kept.append(artist)
+
+    clear_stale_ranks(cur, artists, depth)
+    upsert_lastfm_artists(conn, cur, kept)
+    record_lastfm_snapshot(conn, cur, artists)
+
+    inserted = 0
+    updated = 0
+    unchanged = 0
+    for artist in kept:
+        previous = before[artist["artist_name"]]
+        if previous is None:
+            inserted = inserted + 1
+        elif previous == (artist["listeners"], artist["playcount"], artist["rank"]):
+            unchanged = unchanged + 1
+        else:
+            updated = updated + 1
+
+    print("Inserted " + str(inserted) + " new, updated " + str(updated) +
+          ", " + str(unchanged) + " unchanged Last.fm artists.")
+    return inserted, updated, unchanged
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Store the Last.fm top artists chart.")
+    parser.add_argument("--depth", type=int, default=100,
+                        help="how far down the chart to track")
+    args = parser.parse_args()
+
     conn, cur = get_connection()
     create_tables(cur)
-    store_lastfm_data(conn, cur)
+    store_lastfm_data(conn, cur, depth=args.depth)
     conn.close()
 
 
@@ -0,0 +1,226 @@
+import time
+
+# SQLite's default limit on bound parameters is 999
+MAX_SQL_VARIABLES = 500
+
+
+def load_id_map(cur, table, id_column, name_column):
+    """
+    Read a whole lookup table (Artists or Genres) into {name: id}.
+    Done once per run so each song can be resolved without a query.
+    """
+    cur.execute(f"SELECT {name_column}, {id_column} FROM {table}")
+    id_map = {}
+    for name, row_id in cur.fetchall():
+        id_map[name] = row_id
+    return id_map
+
+
+def load_id_maps(cur):
+    """
+    Return (artist_map, genre_map) for the Spotify tables.
+    """
+    artist_map = load_id_map(cur, "Artists", "artist_id", "artist_name")
+    genre_map = load_id_map(cur, "Genres", "genre_id", "genre_name")
+    return artist_map, genre_map
+
+
+def add_missing_names(cur, id_map, table, id_column, name_column, names):
+    """
+    Insert the names that id_map does not know yet with one executemany,
+    then read back the IDs SQLite gave them and add those to id_map.
+    """
+    new_names = []
+    seen = set()
+    for name in names:
+        if name not in id_map and name not in seen:
+            seen.add(name)
+            new_names.append(name)
+
+    if not new_names:
+        return
+
+    cur.executemany(
+        f"INSERT OR IGNORE INTO {table} ({name_column}) VALUES (?)",
+        [(name,) for name in new_names]
+    )
+
+    for start in range(0, len(new_names), MAX_SQL_VARIABLES):
+        chunk = new_names[start:start + MAX_SQL_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        cur.execute(
+            f"SELECT {name_column}, {id_column} FROM {table} "
+            f"WHERE {name_column} IN ({placeholders})",
+            chunk
+        )
+        for name, row_id in cur.fetchall():
+            id_map[name] = row_id
+
+
+def store_songs(conn, cur, songs, artist_map, genre_map, playlist_id=None):
+    """
+    Write a batch of songs in one transaction.
+
+    songs: list of dicts with song_name, artist_name, popularity, genre_name
+    (plus track_id and position when playlist_id is given, and optionally
+    genres, the artist's full genre list for ArtistGenres, and
+    spotify_artist_id)
+    artist_map / genre_map: name-to-ID maps from load_id_maps(), updated
+    in place as new artists and genres are added.
+    playlist_id: if given, the songs are also recorded in PlaylistTracks.
+
+    Returns the number of songs that were not already stored.
+    """
+    if not songs:
+        return 0
+
+    add_missing_names(cur, artist_map, "Artists", "artist_id", "artist_name",
+                      [song["artist_name"] for song in songs])
+    add_missing_names(cur, genre_map, "Genres", "genre_id", "genre_name",
+                      [song["genre_name"] for song in songs] +
+                      [name for song in songs for name in song.get("genres") or ()])
+
+    rows = []
+    for song in songs:
+        rows.append((song["song_name"],
+                     artist_map[song["artist_name"]],
+                     song["popularity"],
+                     genre_map[song["genre_name"]]))
+
+    cur.executemany(
+        "INSERT OR IGNORE INTO Songs (song_name, artist_id, popularity, genre_id) "
+        "VALUES (?, ?, ?, ?)",
+        rows
+    )
+    inserted = cur.rowcount
+
+    store_artist_genres(cur, songs, artist_map, genre_map)
+
+    if playlist_id is not None:
+        cur.executemany(
+            "INSERT OR REPLACE INTO PlaylistTracks "
+            "(playlist_id, track_id, position, song_name, artist_id, spotify_artist_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(playlist_id, song["track_id"], song["position"], song["song_name"],
+              artist_map[song["artist_name"]], song.get("spotify_artist_id")) for song in songs]
+        )
+
+    conn.commit()
+    return inserted
+
+
+def store_artist_genres(cur, songs, artist_map, genre_map):
+    """
+    Replace the ArtistGenres rows of every artist in songs that carries a
+    genres list. Songs without one (artist not looked up) change nothing.
+    Does not commit.
+    """
+    artist_genres = {}
+    for song in songs:
+        if song.get("genres") is not None:
+            artist_genres[artist_map[song["artist_name"]]] = song["genres"]
+
+    if not artist_genres:
+        return
+
+    cur.executemany("DELETE FROM ArtistGenres WHERE artist_id = ?",
+                    [(artist_id,) for artist_id in artist_genres])
+    cur.executemany(
+        "INSERT OR IGNORE INTO ArtistGenres (artist_id, genre_id, position) VALUES (?, ?, ?)",
+        [(artist_id, genre_map[name], position)
+         for artist_id, genres in artist_genres.items()
+         for position, name in enumerate(genres)]
+    )
+
+
+def get_ingest_state(cur, playlist_id):
+    """
+    Return (snapshot_id, cursor, total) from the last run, or None.
+    """
+    cur.execute(
+        "SELECT snapshot_id, cursor, total FROM IngestState WHERE playlist_id = ?",
+        (playlist_id,)
+    )
+    return cur.fetchone()
+
+
+def save_ingest_state(conn, cur, playlist_id, snapshot_id, cursor, total):
+    cur.execute(
+        "INSERT OR REPLACE INTO IngestState "
+        "(playlist_id, snapshot_id, cursor, total, updated_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (playlist_id, snapshot_id, cursor, total, time.time())
+    )
+    conn.commit()
+
+
+def load_playlist_track_ids(cur, playlist_id):
+    """
+    Return the set of Spotify track IDs already stored for a playlist.
+    """
+    cur.execute("SELECT track_id FROM PlaylistTracks WHERE playlist_id = ?",
+                (playlist_id,))
+    return set(row[0] for row in cur.fetchall())
+
+
+def load_playlist_artists(cur, playlist_id):
+    """
+    Return {Spotify artist ID: Artists.artist_id} for the first artist of
+    every stored track of a playlist whose Spotify artist ID is known.
+    """
+    cur.execute(
+        "SELECT DISTINCT spotify_artist_id, artist_id FROM PlaylistTracks "
+        "WHERE playlist_id = ? AND spotify_artist_id IS NOT NULL AND artist_id IS NOT NULL",
+        (playlist_id,)
+    )
+    return dict(cur.fetchall())
+
+
+def fill_playlist_artist_ids(cur, playlist_id, track_artists):
+    """
+    Set spotify_artist_id on stored tracks that do not have it yet.
+    track_artists: {track_id: Spotify artist ID}. Does not commit.
+    """
+    cur.executemany(
+        "UPDATE PlaylistTracks SET spotify_artist_id = ? "
+        "WHERE playlist_id = ? AND track_id = ? AND spotify_artist_id IS NULL",
+        [(artist_id, playlist_id, track_id) for track_id, artist_id in track_artists.items()
+         if artist_id is not None]
+    )
+
+
+def remove_playlist_tracks(conn, cur, playlist_id, track_ids):
+    """
+    Forget tracks that were taken off a playlist. Their Songs rows are
+    deleted too, unless another playlist still contains the same song.
+    Returns the number of Songs rows deleted.
+    """
+    if not track_ids:
+        return 0
+
+    songs = []
+    track_ids = list(track_ids)
+    for start in range(0, len(track_ids), MAX_SQL_VARIABLES):
+        chunk = track_ids[start:start + MAX_SQL_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        cur.execute(
+            "SELECT song_name, artist_id FROM PlaylistTracks "
+            f"WHERE playlist_id = ? AND track_id IN ({placeholders})",
+            [playlist_id] + chunk
+        )
+        songs.extend(cur.fetchall())
+
+    cur.executemany(
+        "DELETE FROM PlaylistTracks WHERE playlist_id = ? AND track_id = ?",
+        [(playlist_id, track_id) for track_id in track_ids]
+    )
+    cur.executemany("""
+        DELETE FROM Songs
+        WHERE song_name = ? AND artist_id = ?
+          AND NOT EXISTS (SELECT 1 FROM PlaylistTracks
+                          WHERE song_name = ? AND artist_id = ?)
+    """, [(name, artist_id, name, artist_id) for name, artist_id in songs])
+    deleted = cur.rowcount
+
+    conn.commit()
+    return deleted
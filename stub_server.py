@@ -0,0 +1,277 @@
+"""
+Local stand-in for the Spotify and Last.fm APIs that serves recorded
+fixtures, so ingestion can be run and timed on an offline machine.
+
+Record real responses once:
+    HTTP_RECORD_DIR=fixtures python Spotify_Data.py
+    HTTP_RECORD_DIR=fixtures python store_lastfm.py
+
+Replay them (in another shell):
+    python stub_server.py --fixtures fixtures --latency 80 --error-rate 0.05
+    HTTP_REPLAY_URL=http://127.0.0.1:8765 HTTP_CACHE_DB=/tmp/replay_cache.db \\
+        python Spotify_Data.py
+
+--latency/--jitter add a delay to every response, --error-rate answers
+that fraction of requests with 429 + Retry-After, and --page-size
+re-paginates recorded Spotify and Last.fm lists into smaller pages.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode
+
+from fixtures import fixture_key, load_fixtures
+
+SPOTIFY_PAGE_PARAMS = ("offset", "limit")
+LASTFM_PAGE_PARAMS = ("page", "limit")
+
+# Spotify's default page size when a request gives no limit
+SPOTIFY_DEFAULT_LIMIT = 20
+LASTFM_DEFAULT_LIMIT = 50
+
+
+def _lastfm_list(body):
+    """
+    Find the list inside a Last.fm paged response, e.g. body["artists"]["artist"].
+    Returns (outer_key, list_key, attr) or None.
+    """
+    if not isinstance(body, dict) or len(body) != 1:
+        return None
+    outer_key = list(body.keys())[0]
+    block = body[outer_key]
+    if not isinstance(block, dict) or "@attr" not in block:
+        return None
+    for list_key, value in block.items():
+        if isinstance(value, list):
+            return outer_key, list_key, block["@attr"]
+    return None
+
+
+class FixtureStore:
+    """
+    Recorded responses, plus every paged list merged back into one list so
+    it can be served again with any page size.
+    """
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+        self.spotify_lists = {}
+        self.lastfm_lists = {}
+
+        for fixture in fixtures.values():
+            if fixture["status"] != 200:
+                continue
+            try:
+                body = json.loads(fixture["body"])
+            except ValueError:
+                continue
+            url = "https://" + fixture["host"] + fixture["path"] + "?" + fixture["query"]
+            query = dict(parse_qsl(fixture["query"]))
+
+            if isinstance(body, dict) and isinstance(body.get("items"), list) and "next" in body:
+                key = fixture_key(fixture["method"], url, drop=SPOTIFY_PAGE_PARAMS)
+                offset = int(query.get("offset", 0))
+                self._place(self.spotify_lists, key, offset, body["items"])
+                continue
+
+            found = _lastfm_list(body)
+            if found is not None:
+                outer_key, list_key, attr = found
+                key = fixture_key(fixture["method"], url, drop=LASTFM_PAGE_PARAMS)
+                page = int(attr.get("page", 1))
+                per_page = int(attr.get("perPage", len(body[outer_key][list_key])))
+                self._place(self.lastfm_lists, key, (page - 1) * per_page,
+                            body[outer_key][list_key], (outer_key, list_key))
+
+    def _place(self, lists, key, offset, items, names=None):
+        entry = lists.setdefault(key, {"items": [], "names": names})
+        merged = entry["items"]
+        if len(merged) < offset + len(items):
+            merged.extend([None] * (offset + len(items) - len(merged)))
+        merged[offset:offset + len(items)] = items
+
+    def spotify_page(self, method, host, path, query, page_size):
+        url = "https://" + host + path + "?" + urlencode(query)
+        entry = self.spotify_lists.get(fixture_key(method, url, drop=SPOTIFY_PAGE_PARAMS))
+        if entry is None:
+            return None
+
+        items = entry["items"]
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", SPOTIFY_DEFAULT_LIMIT))
+        if page_size:
+            limit = min(limit, page_size)
+
+        next_url = None
+        if offset + limit < len(items):
+            next_query = dict(query)
+            next_query["offset"] = offset + limit
+            next_query["limit"] = limit
+            next_url = "https://" + host + path + "?" + urlencode(next_query)
+
+        return {
+            "items": items[offset:offset + limit],
+            "offset": offset,
+            "limit": limit,
+            "total": len(items),
+            "next": next_url
+        }
+
+    def lastfm_page(self, method, host, path, query, page_size):
+        url = "https://" + host + path + "?" + urlencode(query)
+        entry = self.lastfm_lists.get(fixture_key(method, url, drop=LASTFM_PAGE_PARAMS))
+        if entry is None:
+            return None
+
+        items = entry["items"]
+        outer_key, list_key = entry["names"]
+        page = int(query.get("page", 1))
+        limit = int(query.get("limit", LASTFM_DEFAULT_LIMIT))
+        if page_size:
+            limit = min(limit, page_size)
+        start = (page - 1) * limit
+        total_pages = (len(items) + limit - 1) // limit
+
+        return {
+            outer_key: {
+                list_key: items[start:start + limit],
+                "@attr": {
+                    "page": str(page),
+                    "perPage": str(limit),
+                    "totalPages": str(total_pages),
+                    "total": str(len(items))
+                }
+            }
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Set on the class by main()
+    store = None
+    options = None
+    counters = None
+    counters_lock = threading.Lock()
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # One line per request is too noisy when benchmarking
+        pass
+
+    def _count(self, name):
+        with self.counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def _send(self, status, body, headers=None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            if name.lower() not in ("content-type", "content-length"):
+                self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        self._count("requests")
+
+        # Drain any request body so the keep-alive connection stays usable
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+
+        options = self.options
+        delay = options.latency / 1000.0
+        if options.jitter:
+            delay = delay + random.uniform(0, options.jitter / 1000.0)
+        if delay > 0:
+            time.sleep(delay)
+
+        path_part, _, query_string = self.path.partition("?")
+        host, _, rest = path_part.lstrip("/").partition("/")
+        path = "/" + rest
+        query = dict(parse_qsl(query_string, keep_blank_values=True))
+
+        if host == "accounts.spotify.com" and path == "/api/token":
+            self._count("tokens")
+            self._send(200, json.dumps({"access_token": "replay-token",
+                                        "token_type": "Bearer",
+                                        "expires_in": 3600}))
+            return
+
+        if options.error_rate and random.random() < options.error_rate:
+            self._count("injected_429")
+            self._send(429, json.dumps({"error": {"status": 429, "message": "rate limited"}}),
+                       {"Retry-After": str(options.retry_after)})
+            return
+
+        page = None
+        url = "https://" + host + path
+        if query_string:
+            url = url + "?" + query_string
+        exact = self.store.fixtures.get(fixture_key(method, url))
+
+        if options.page_size or exact is None:
+            page = self.store.spotify_page(method, host, path, query, options.page_size)
+            if page is None:
+                page = self.store.lastfm_page(method, host, path, query, options.page_size)
+
+        if page is not None:
+            self._count("paged")
+            self._send(200, json.dumps(page))
+        elif exact is not None:
+            self._count("fixtures")
+            self._send(exact["status"], exact["body"], exact["headers"])
+        else:
+            self._count("missing")
+            print("No fixture for " + method + " " + url)
+            self._send(404, json.dumps({"error": {"status": 404, "message": "no fixture"}}))
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded API responses locally.")
+    parser.add_argument("--fixtures", default="fixtures", help="directory written in record mode")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="added delay per response (ms)")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random delay up to this many ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--page-size", type=int, default=0, help="re-paginate recorded lists to this size")
+    options = parser.parse_args()
+
+    StubHandler.store = FixtureStore(load_fixtures(options.fixtures))
+    StubHandler.options = options
+    StubHandler.counters = {}
+
+    server = ThreadingHTTPServer((options.host, options.port), StubHandler)
+    print(f"Serving {len(StubHandler.store.fixtures)} fixtures on http://{options.host}:{options.port}")
+
+    started = time.time()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    elapsed = time.time() - started
+    counters = StubHandler.counters
+    print(json.dumps(counters, sort_keys=True))
+    if elapsed > 0:
+        print("{0:.1f} requests/s over {1:.1f}s".format(counters.get("requests", 0) / elapsed, elapsed))
+
+
+if __name__ == "__main__":
+    main()